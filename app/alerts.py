@@ -0,0 +1,515 @@
+"""
+監控程式內建告警規則引擎
+掃描快照一產生就評估各租戶 / Pinned 群組的閾值規則，不必等 Pushgateway
+與 Prometheus 抓取週期。支援：
+  - 個別租戶閾值（cid 指定）與全租戶規則（cid = "*"）
+  - 群組加總閾值（預設群組 pinned = PINNED_CIDS）
+  - 遲滯（threshold 觸發、clear 才解除）與連續 N 輪才觸發（for_scans）
+  - 抖動抑制：最近 flap_window 輪內狀態切換達 flap_limit 次即暫停通知
+  - 每輪一次、批次送往所有通知管道（log / webhook / alertmanager）
+
+規則依 CID 建立索引，每輪評估成本為 O(租戶數 + 規則數)。
+"""
+import json
+import logging
+import operator
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sinks import MetricsSink, ScanSnapshot, register_sink
+
+logger = logging.getLogger(__name__)
+
+_OPS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+
+TENANT_METRICS = ("count", "change", "change_pct", "drop_pct")
+GROUP_METRICS = ("total",)
+
+
+class AlertRule:
+    """單一閾值規則"""
+
+    def __init__(self, name: str, metric: str, op: str, threshold: float,
+                 clear: Optional[float] = None, for_scans: int = 1, severity: str = "warning",
+                 cid: Optional[str] = None, group: Optional[str] = None, summary: str = ""):
+        if op not in _OPS:
+            raise ValueError(f"規則 {name}: 不支援的運算子 {op}")
+        if group is None and metric not in TENANT_METRICS:
+            raise ValueError(f"規則 {name}: 租戶規則不支援 metric {metric}")
+        if group is not None and metric not in GROUP_METRICS:
+            raise ValueError(f"規則 {name}: 群組規則不支援 metric {metric}")
+        self.name = name
+        self.metric = metric
+        self.op = op
+        self.threshold = threshold
+        self.clear = threshold if clear is None else clear
+        self.for_scans = max(int(for_scans), 1)
+        self.severity = severity
+        self.cid = cid.lower() if cid else "*"
+        self.group = group
+        self.summary = summary
+        self._cmp = _OPS[op]
+        # 解除條件：'>' 類規則需回到 clear 以下（含），'<' 類規則需回到 clear 以上（含）
+        self._clear_cmp = operator.le if op in (">", ">=") else operator.ge
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "AlertRule":
+        return cls(
+            name=d["name"], metric=d.get("metric", "count"), op=d.get("op", ">"),
+            threshold=d["threshold"], clear=d.get("clear"), for_scans=d.get("for_scans", 1),
+            severity=d.get("severity", "warning"), cid=d.get("cid"), group=d.get("group"),
+            summary=d.get("summary", ""),
+        )
+
+    def breached(self, value: float) -> bool:
+        return self._cmp(value, self.threshold)
+
+    def cleared(self, value: float) -> bool:
+        return self._clear_cmp(value, self.clear)
+
+
+class AlertState:
+    """單一 (規則, 對象) 的狀態"""
+
+    __slots__ = ("rule", "target_name", "state", "notified", "breaches", "since", "value", "history")
+
+    def __init__(self, rule: AlertRule, target_name: str, flap_window: int):
+        self.rule = rule
+        self.target_name = target_name
+        self.state = "ok"           # ok / pending / firing
+        self.notified = "ok"        # 最後一次通知出去的狀態
+        self.breaches = 0
+        self.since = None
+        self.value = None
+        self.history = deque(maxlen=flap_window)   # 每輪是否發生 ok <-> firing 切換
+
+    def to_dict(self) -> Dict:
+        return {"target_name": self.target_name, "state": self.state,
+                "notified": self.notified, "breaches": self.breaches,
+                "since": self.since, "value": self.value, "history": list(self.history)}
+
+    @classmethod
+    def from_dict(cls, rule: AlertRule, d: Dict, flap_window: int) -> "AlertState":
+        st = cls(rule, d.get("target_name", ""), flap_window)
+        st.state = d.get("state", "ok")
+        st.notified = d.get("notified", "ok")
+        st.breaches = d.get("breaches", 0)
+        st.since = d.get("since")
+        st.value = d.get("value")
+        st.history.extend(d.get("history", []))
+        return st
+
+
+def tenant_metrics(t: Dict) -> Dict[str, Optional[float]]:
+    count = t['count']
+    change = t.get('change', 0)
+    old = count - change
+    pct = (change / old * 100) if old > 0 else None
+    return {
+        "count": count,
+        "change": change,
+        "change_pct": pct,
+        "drop_pct": -pct if pct is not None else None,
+    }
+
+
+class AlertEngine:
+    """依 CID 索引規則並維護告警狀態"""
+
+    def __init__(self, rules: List[AlertRule], groups: Dict[str, List[str]],
+                 flap_window: int = 6, flap_limit: int = 4):
+        self.flap_window = flap_window
+        self.flap_limit = flap_limit
+        self.groups = {g: [c.lower() for c in cids] for g, cids in groups.items()}
+        self.states: Dict[Tuple[str, str], AlertState] = {}
+
+        self._tenant_rules: Dict[str, List[AlertRule]] = {}
+        self._wildcard_rules: List[AlertRule] = []
+        self._group_rules: List[AlertRule] = []
+        self._by_target: Dict[Tuple[str, str], AlertRule] = {}
+        for rule in rules:
+            key = (rule.name, rule.group or rule.cid)
+            if key in self._by_target:
+                raise ValueError(f"規則重複: {rule.name} ({key[1]})")
+            self._by_target[key] = rule
+            if rule.group is not None:
+                if rule.group not in self.groups:
+                    raise ValueError(f"規則 {rule.name}: 未定義的群組 {rule.group}")
+                self._group_rules.append(rule)
+            elif rule.cid == "*":
+                self._wildcard_rules.append(rule)
+            else:
+                self._tenant_rules.setdefault(rule.cid, []).append(rule)
+
+        # cid -> 所屬群組，讓群組加總能在同一次租戶迴圈中完成
+        self._membership: Dict[str, List[str]] = {}
+        for group, cids in self.groups.items():
+            for cid in cids:
+                self._membership.setdefault(cid, []).append(group)
+
+    @property
+    def rule_count(self) -> int:
+        return (sum(len(r) for r in self._tenant_rules.values())
+                + len(self._wildcard_rules) + len(self._group_rules))
+
+    def evaluate(self, snapshot: ScanSnapshot) -> Dict:
+        """評估一輪快照，回傳批次通知內容"""
+        now = snapshot.scanned_at.timestamp()
+        firing, resolved = [], []
+        touched = set()
+        skipped = set()             # 本輪查詢失敗的租戶：個別規則狀態維持上一輪
+        group_totals = {g: 0 for g in self.groups}
+
+        def apply(rule: AlertRule, target: str, target_name: str, value: Optional[float]):
+            if value is None:
+                return
+            key = (rule.name, target)
+            touched.add(key)
+            st = self.states.get(key)
+            if st is None:
+                if not rule.breached(value):
+                    return          # 正常且無歷史的對象不保留狀態
+                st = self.states[key] = AlertState(rule, target_name, self.flap_window)
+            st.target_name = target_name
+            change = self._step(rule, st, value, now)
+            if st.state == "ok" and st.notified == "ok" and not any(st.history):
+                del self.states[key]
+            if change is None:
+                return
+            alert = self._alert(target, st)
+            (firing if change == "firing" else resolved).append(alert)
+
+        for cid, t in snapshot.tenants.items():
+            for group in self._membership.get(cid, ()):
+                group_totals[group] += t['count']
+            if t.get('failed'):
+                skipped.add(cid)
+                continue
+            metrics = tenant_metrics(t)
+            for rule in self._tenant_rules.get(cid, ()):
+                apply(rule, cid, t['name'], metrics[rule.metric])
+            for rule in self._wildcard_rules:
+                apply(rule, cid, t['name'], metrics[rule.metric])
+
+        for rule in self._group_rules:
+            apply(rule, rule.group, rule.group, group_totals[rule.group])
+
+        # 本輪沒有出現的對象（例如租戶已移除）：記一輪無切換，歷史清空後釋放
+        for key in [k for k in self.states if k not in touched and k[1] not in skipped]:
+            st = self.states[key]
+            st.history.append(False)
+            if st.state != "firing" and st.notified == "ok" and not any(st.history):
+                del self.states[key]
+
+        return {
+            "scan_time": snapshot.scanned_at.isoformat(),
+            "firing": firing,
+            "resolved": resolved,
+            "active": [self._alert(target, st) for (_, target), st in self.states.items()
+                       if st.notified == "firing"],
+        }
+
+    def _step(self, rule: AlertRule, st: AlertState, value: float, now: float) -> Optional[str]:
+        """推進狀態機，需要通知時回傳 'firing' / 'resolved'"""
+        previous = st.state
+        st.value = value
+        if rule.breached(value):
+            st.breaches += 1
+            if st.state != "firing":
+                st.state = "firing" if st.breaches >= rule.for_scans else "pending"
+        else:
+            st.breaches = 0
+            if st.state == "pending" or (st.state == "firing" and rule.cleared(value)):
+                st.state = "ok"
+
+        switched = (previous == "firing") != (st.state == "firing")
+        if switched:
+            st.since = now
+        st.history.append(switched)
+
+        if sum(st.history) >= self.flap_limit:
+            if switched:
+                logger.info(f"告警 {rule.name} 抖動中，暫停通知")
+            return None
+
+        current = "firing" if st.state == "firing" else "ok"
+        if current == st.notified:
+            return None
+        st.notified = current
+        return "firing" if current == "firing" else "resolved"
+
+    @staticmethod
+    def _alert(target: str, st: AlertState) -> Dict:
+        rule = st.rule
+        return {
+            "name": rule.name,
+            "severity": rule.severity,
+            "target": target,
+            "target_name": st.target_name or target,
+            "metric": rule.metric,
+            "value": st.value,
+            "threshold": rule.threshold,
+            "state": "firing" if st.state == "firing" else "resolved",
+            "since": st.since,
+            "summary": rule.summary,
+        }
+
+    # ── 狀態保存 ──────────────────────────────────────────────
+    def save_state(self, path: str):
+        payload = {f"{name}|{target}": st.to_dict() for (name, target), st in self.states.items()}
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(payload, f)
+        os.replace(f"{path}.tmp", path)
+
+    def load_state(self, path: str):
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "r") as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"讀取告警狀態失敗: {e}")
+            return
+        wildcard = {rule.name: rule for rule in self._wildcard_rules}
+        for key, d in payload.items():
+            name, _, target = key.partition("|")
+            rule = self._by_target.get((name, target)) or wildcard.get(name)
+            if rule is None:
+                continue        # 規則已移除
+            self.states[(name, target)] = AlertState.from_dict(rule, d, self.flap_window)
+
+
+def default_rules(threshold: int) -> Tuple[List[AlertRule], Dict]:
+    """未提供規則檔時的預設規則（對應原本 prometheus/rules/alerts.yml 的租戶規則）"""
+    rules = [
+        AlertRule("PinnedCIDsOverThreshold", "total", ">", threshold,
+                  clear=int(threshold * 0.98), severity="critical", group="pinned",
+                  summary="CrowdStrike Pinned CIDs 超過授權閾值"),
+        AlertRule("TenantHostCountSpike", "change_pct", ">", 20, clear=10,
+                  severity="warning", summary="租戶端點數異常增加"),
+        AlertRule("TenantHostCountDrop", "drop_pct", ">", 30, clear=15,
+                  severity="warning", summary="租戶端點數異常減少"),
+    ]
+    return rules, {}
+
+
+def load_rules(path: Optional[str], threshold: int) -> Tuple[List[AlertRule], Dict]:
+    """
+    規則檔（JSON）格式：
+    {
+      "groups": {"billing-a": ["cid1", "cid2"]},
+      "rules": [
+        {"name": "...", "group": "pinned", "metric": "total", "op": ">", "threshold": 375, "clear": 360},
+        {"name": "...", "cid": "cid1", "metric": "count", "op": ">", "threshold": 200, "for_scans": 2}
+      ]
+    }
+    """
+    if not path or not os.path.exists(path):
+        return default_rules(threshold)
+    with open(path, "r", encoding="utf-8") as f:
+        payload = json.load(f)
+    return [AlertRule.from_dict(r) for r in payload.get("rules", [])], payload.get("groups", {})
+
+
+# ═══════════════════════════════════════════════════════════
+#  通知管道
+# ═══════════════════════════════════════════════════════════
+CHANNEL_REGISTRY: Dict[str, type] = {}
+
+
+def register_channel(name: str) -> Callable[[type], type]:
+    def decorator(cls):
+        cls.name = name
+        CHANNEL_REGISTRY[name] = cls
+        return cls
+    return decorator
+
+
+class NotificationChannel:
+    name = "channel"
+
+    def send(self, batch: Dict):
+        raise NotImplementedError
+
+
+def _post_json(http_pool, url: str, payload, timeout: float = 10):
+    if http_pool is not None:
+        resp = http_pool.session.post(url, json=payload, timeout=timeout)
+    else:
+        import requests
+        resp = requests.post(url, json=payload, timeout=timeout)
+    if resp.status_code >= 400:
+        raise IOError(f"{url} 回應錯誤: {resp.status_code}")
+
+
+@register_channel("log")
+class LogChannel(NotificationChannel):
+    """本機替代管道：寫入日誌並附加到 JSON lines 檔"""
+
+    def __init__(self, log_file: Optional[str] = None, **_):
+        self.log_file = log_file
+
+    def send(self, batch: Dict):
+        if not batch["firing"] and not batch["resolved"]:
+            return
+        for alert in batch["firing"]:
+            logger.warning(f"🔔 告警觸發 [{alert['severity']}] {alert['name']} "
+                           f"{alert['target_name']}: {alert['value']} (閾值 {alert['threshold']})")
+        for alert in batch["resolved"]:
+            logger.info(f"✅ 告警解除 {alert['name']} {alert['target_name']}: {alert['value']}")
+        if self.log_file:
+            with open(self.log_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps({k: batch[k] for k in ("scan_time", "firing", "resolved")},
+                                   ensure_ascii=False) + "\n")
+
+
+@register_channel("webhook")
+class WebhookChannel(NotificationChannel):
+    """每輪以單一 POST 送出本輪所有告警變化"""
+
+    def __init__(self, webhook_url: str, http_pool=None, **_):
+        if not webhook_url:
+            raise ValueError("未設定 ALERT_WEBHOOK_URL")
+        self.url = webhook_url
+        self.http_pool = http_pool
+
+    def send(self, batch: Dict):
+        if batch["firing"] or batch["resolved"]:
+            _post_json(self.http_pool, self.url, batch)
+
+
+@register_channel("alertmanager")
+class AlertmanagerChannel(NotificationChannel):
+    """
+    推送到 Alertmanager v2 API，沿用既有的分組 / 抑制 / 郵件設定。
+    觸發中的告警每輪重送並把 endsAt 設在數輪之後，避免被 resolve_timeout 自動解除。
+    """
+
+    def __init__(self, alertmanager_url: str, refresh_seconds: int = 3600, http_pool=None, **_):
+        self.url = alertmanager_url.rstrip("/") + "/api/v2/alerts"
+        self.refresh = timedelta(seconds=refresh_seconds * 3)
+        self.http_pool = http_pool
+
+    def send(self, batch: Dict):
+        now = datetime.now(timezone.utc)
+        payload = [self._to_am(a, ends_at=now + self.refresh) for a in batch["active"]]
+        payload += [self._to_am(a, ends_at=now) for a in batch["resolved"]]
+        if payload:
+            _post_json(self.http_pool, self.url, payload)
+
+    @staticmethod
+    def _to_am(alert: Dict, ends_at: datetime) -> Dict:
+        started = alert["since"] or ends_at.timestamp()
+        return {
+            "labels": {
+                "alertname": alert["name"],
+                "severity": alert["severity"],
+                "team": "security",
+                "target": alert["target"],
+                "tenant_name": alert["target_name"],
+            },
+            "annotations": {
+                "summary": alert["summary"] or alert["name"],
+                "description": f"{alert['target_name']} {alert['metric']} = {alert['value']}"
+                               f"（閾值 {alert['threshold']}）",
+            },
+            "startsAt": datetime.fromtimestamp(started, timezone.utc).isoformat(),
+            "endsAt": ends_at.isoformat(),
+        }
+
+
+def _merge_pending(batch: Dict, pending: Optional[Dict]) -> Dict:
+    """
+    把上一輪未送達的變化併入本輪批次；同一 (規則, 對象) 本輪已有新變化時，
+    以本輪為準，舊的那筆不再送出。
+    """
+    if not pending:
+        return batch
+    latest = {(a["name"], a["target"]) for a in batch["firing"] + batch["resolved"]}
+    merged = dict(batch)
+    for kind in ("firing", "resolved"):
+        merged[kind] = [a for a in pending.get(kind, ())
+                        if (a["name"], a["target"]) not in latest] + batch[kind]
+    return merged
+
+
+# ═══════════════════════════════════════════════════════════
+#  Sink 包裝
+# ═══════════════════════════════════════════════════════════
+@register_sink("alerts")
+class AlertSink(MetricsSink):
+    """把告警評估放進 sink 分送流程，通知管道卡住不會拖慢其他 sink"""
+
+    label = "Alerts"
+
+    def __init__(self, threshold: int, pinned_list: List[str], rules_file: Optional[str] = None,
+                 state_file: Optional[str] = None, channels: Optional[List[str]] = None,
+                 flap_window: int = 6, flap_limit: int = 4, channel_options: Optional[Dict] = None, **_):
+        rules, groups = load_rules(rules_file, threshold)
+        groups.setdefault("pinned", pinned_list)
+        self.engine = AlertEngine(rules, groups, flap_window=flap_window, flap_limit=flap_limit)
+        self.state_file = state_file
+        # 通知管道名稱 -> 尚未送達的 {"firing": [...], "resolved": [...]}，下一輪併入批次重送
+        self.pending: Dict[str, Dict[str, List[Dict]]] = {}
+        if state_file:
+            self.engine.load_state(state_file)
+            self._load_pending()
+
+        self.channels: List[NotificationChannel] = []
+        for name in channels or ["log"]:
+            cls = CHANNEL_REGISTRY.get(name)
+            if cls is None:
+                logger.error(f"未知的通知管道: {name}")
+                continue
+            try:
+                self.channels.append(cls(**(channel_options or {})))
+            except Exception as e:
+                logger.error(f"通知管道 {name} 初始化失敗: {e}")
+        logger.info(f"告警引擎載入 {self.engine.rule_count} 條規則")
+
+    def write(self, snapshot: ScanSnapshot) -> str:
+        start = time.perf_counter()
+        batch = self.engine.evaluate(snapshot)
+        elapsed = (time.perf_counter() - start) * 1000
+
+        errors = []
+        for channel in self.channels:
+            merged = _merge_pending(batch, self.pending.get(channel.name))
+            try:
+                channel.send(merged)
+            except Exception as e:
+                logger.error(f"通知管道 {channel.name} 發送失敗，下一輪重送: {e}")
+                errors.append(channel.name)
+                self.pending[channel.name] = {k: merged[k] for k in ("firing", "resolved")}
+            else:
+                self.pending.pop(channel.name, None)
+        if self.state_file:
+            self.engine.save_state(self.state_file)
+            self._save_pending()
+
+        status = (f"觸發中 {len(batch['active'])} / 新觸發 {len(batch['firing'])} / "
+                  f"解除 {len(batch['resolved'])}  ({elapsed:.1f} ms)")
+        if errors:
+            raise IOError(f"{status}，通知失敗: {', '.join(errors)}")
+        return status
+
+    @property
+    def _pending_file(self) -> str:
+        return f"{self.state_file}.pending"
+
+    def _save_pending(self):
+        with open(f"{self._pending_file}.tmp", "w") as f:
+            json.dump(self.pending, f)
+        os.replace(f"{self._pending_file}.tmp", self._pending_file)
+
+    def _load_pending(self):
+        if not os.path.exists(self._pending_file):
+            return
+        try:
+            with open(self._pending_file, "r") as f:
+                self.pending = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"讀取待重送告警失敗: {e}")
@@ -0,0 +1,169 @@
+"""
+歷史回補
+以主機 first_seen / last_seen 重建過去每日各租戶的活躍端點數，
+並以歷史時間戳寫入 InfluxDB，補齊監控停機期間的資料缺口。
+
+每個租戶只批次拉取一次主機生命週期，再以排序後的陣列一次掃過所有日期；
+租戶之間平行處理，進度存於 checkpoint 檔，中斷後重跑會從未完成處接續。
+
+假設：主機在 first_seen 與 last_seen 之間持續在線（已刪除 / 隱藏的主機不在 API 結果中）。
+"""
+import json
+import logging
+import os
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, List, Tuple
+
+from host_inventory import iter_host_details, parse_timestamp
+from sinks import MetricsSink, ScanSnapshot
+
+logger = logging.getLogger(__name__)
+
+# 與 fetch_count 的 last_seen:>'now-7d' 一致
+ACTIVE_WINDOW = 7 * 86400
+
+
+def day_ends(start: date, end: date) -> List[datetime]:
+    """每日的結算時間點（UTC 23:59:59）"""
+    days = []
+    day = start
+    while day <= end:
+        days.append(datetime.combine(day, time(23, 59, 59), tzinfo=timezone.utc))
+        day += timedelta(days=1)
+    return days
+
+
+def daily_active_counts(first_seen: List[float], last_seen: List[float],
+                        points: List[float], window: int = ACTIVE_WINDOW) -> List[int]:
+    """
+    計算每個時間點 t 的活躍主機數：first_seen <= t 且 last_seen > t - window。
+    因 first_seen <= last_seen，last_seen <= t - window 的主機必然 first_seen <= t，
+    所以 count(t) = #(first_seen <= t) - #(last_seen <= t - window)，兩次二分搜尋即可。
+    """
+    firsts = sorted(first_seen)
+    lasts = sorted(last_seen)
+    return [bisect_right(firsts, t) - bisect_right(lasts, t - window) for t in points]
+
+
+def _fql_time(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class Backfiller:
+    """平行、可續跑的歷史回補"""
+
+    def __init__(self, creds: Dict, parent_cid: str, tenant_map: Dict[str, str],
+                 pinned_list: List[str], threshold: int, sink: MetricsSink,
+                 checkpoint_path: str, workers: int = 4):
+        self.creds = creds
+        self.parent_cid = parent_cid
+        self.tenant_map = tenant_map
+        self.pinned_list = pinned_list
+        self.threshold = threshold
+        self.sink = sink
+        self.checkpoint_path = checkpoint_path
+        self.workers = max(workers, 1)
+        self._lock = threading.Lock()
+        self._state: Dict = {}
+
+    # ── checkpoint ────────────────────────────────────────────
+    def _load_checkpoint(self, window_key: str):
+        state = {}
+        if os.path.exists(self.checkpoint_path):
+            try:
+                with open(self.checkpoint_path, "r") as f:
+                    state = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"讀取回補 checkpoint 失敗，將重新開始: {e}")
+        if state.get("window") != window_key:
+            state = {"window": window_key, "tenants": {}, "written_days": []}
+        self._state = state
+
+    def _save_checkpoint(self):
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._state, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    # ── 單一租戶 ──────────────────────────────────────────────
+    def fetch_tenant_counts(self, cid: str, points: List[datetime]) -> List[int]:
+        """一次拉取租戶所有相關主機的生命週期，計算每日活躍數"""
+        from falconpy import Hosts
+
+        is_parent = (cid == self.parent_cid)
+        hosts_api = Hosts(**self.creds, member_cid=None if is_parent else cid)
+        since = points[0] - timedelta(seconds=ACTIVE_WINDOW)
+        fql = f"last_seen:>'{_fql_time(since)}'+first_seen:<='{_fql_time(points[-1])}'"
+
+        first_seen, last_seen = [], []
+        for host in iter_host_details(hosts_api, fql):
+            first = parse_timestamp(host.get("first_seen"))
+            last = parse_timestamp(host.get("last_seen"))
+            if first is None or last is None:
+                continue
+            first_seen.append(first)
+            last_seen.append(max(first, last))
+
+        return daily_active_counts(first_seen, last_seen, [p.timestamp() for p in points])
+
+    # ── 主流程 ────────────────────────────────────────────────
+    def run(self, start: date, end: date) -> Tuple[int, List[str]]:
+        """回補 [start, end]，回傳 (寫入天數, 失敗租戶)"""
+        if start > end:
+            raise ValueError(f"回補起始日 {start} 晚於結束日 {end}")
+        if end >= datetime.now(timezone.utc).date():
+            raise ValueError(f"回補結束日 {end} 必須早於今天（UTC）")
+        points = day_ends(start, end)
+        self._load_checkpoint(f"{start.isoformat()}:{end.isoformat()}")
+        done = self._state["tenants"]
+        pending = [cid for cid in self.tenant_map if cid not in done]
+        print(f"  🔁 回補 {start} ~ {end}（{len(points)} 天），"
+              f"{len(self.tenant_map)} 個租戶，{len(done)} 個已完成")
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.fetch_tenant_counts, cid, points): cid for cid in pending}
+            for idx, future in enumerate(as_completed(futures), start=1):
+                cid = futures[future]
+                name = self.tenant_map[cid]
+                try:
+                    counts = future.result()
+                except Exception as e:
+                    logger.error(f"回補 {name} ({cid}) 失敗: {e}")
+                    failed.append(cid)
+                    print(f"  [{idx:>3}/{len(pending)}] {name[:30]:<30}  ❌ {e}")
+                    continue
+                with self._lock:
+                    done[cid] = counts
+                    self._save_checkpoint()
+                print(f"  [{idx:>3}/{len(pending)}] {name[:30]:<30}  ✅ {counts[-1] if counts else 0} 台")
+
+        if failed:
+            # 資料不完整時不寫入，避免 Pinned 總計失真；重跑會只補失敗的租戶
+            print(f"  ❌ {len(failed)} 個租戶失敗，未寫入任何資料，請重新執行以續跑")
+            return 0, failed
+
+        written = set(self._state["written_days"])
+        days_written = 0
+        for i, point in enumerate(points):
+            day_key = point.date().isoformat()
+            if day_key in written:
+                continue
+            tenants = {}
+            for cid, name in self.tenant_map.items():
+                count = done[cid][i]
+                prev = done[cid][i - 1] if i > 0 else count
+                tenants[cid] = {
+                    'name': name, 'count': count,
+                    'is_pinned': cid in self.pinned_list, 'change': count - prev
+                }
+            self.sink.write(ScanSnapshot(tenants, self.parent_cid, self.threshold, scanned_at=point))
+            self._state["written_days"].append(day_key)
+            self._save_checkpoint()
+            days_written += 1
+
+        print(f"  ✅ 回補完成，寫入 {days_written} 天")
+        return days_written, []
@@ -0,0 +1,70 @@
+"""
+告警規則引擎基準測試
+以 N 個租戶、每租戶一條個別規則（另加全租戶與群組規則）評估多輪快照，
+確認每輪耗時隨租戶數線性成長，並統計觸發 / 解除 / 抖動抑制的數量。
+
+使用方式：python bench_alerts.py [規則數，預設 10000] [輪數，預設 20]
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from alerts import AlertEngine, AlertRule, default_rules
+from sinks import ScanSnapshot
+
+
+def build_engine(n: int) -> AlertEngine:
+    cids = [f"{i:032x}" for i in range(n)]
+    rules, groups = default_rules(threshold=n * 50)
+    groups["pinned"] = cids[: n // 10]
+    rules += [AlertRule("TenantHostLimit", "count", ">", 900, clear=850, for_scans=2, cid=cid)
+              for cid in cids]
+    return AlertEngine(rules, groups)
+
+
+def build_scans(n: int, rounds: int, seed: int = 42):
+    rng = random.Random(seed)
+    counts = {f"{i:032x}": rng.randint(100, 950) for i in range(n)}
+    start = datetime.now(timezone.utc)
+    scans = []
+    for r in range(rounds):
+        tenants = {}
+        for cid, old in counts.items():
+            new = max(int(old * rng.uniform(0.9, 1.1)), 0)
+            tenants[cid] = {"name": f"tenant {cid[-6:]}", "count": new, "is_pinned": False,
+                            "change": new - old}
+            counts[cid] = new
+        scans.append(ScanSnapshot(tenants, "p" * 32, n * 50, scanned_at=start + timedelta(hours=r)))
+    return scans
+
+
+def bench(n: int, rounds: int) -> float:
+    engine = build_engine(n)
+    scans = build_scans(n, rounds)
+    fired = resolved = 0
+    start = time.perf_counter()
+    for snapshot in scans:
+        batch = engine.evaluate(snapshot)
+        fired += len(batch["firing"])
+        resolved += len(batch["resolved"])
+    per_scan = (time.perf_counter() - start) / rounds * 1000
+    print(f"  {n:>6} 租戶 / {engine.rule_count:>6} 條規則  每輪 {per_scan:8.2f} ms  "
+          f"觸發 {fired:>5}  解除 {resolved:>5}  保留狀態 {len(engine.states):>5}")
+    return per_scan
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print("=" * 70)
+    print("  告警規則引擎基準測試")
+    print("=" * 70)
+    results = {size: bench(size, rounds) for size in (n // 10, n // 2, n)}
+    small, large = n // 10, n
+    ratio = results[large] / max(results[small], 1e-9)
+    print(f"\n  租戶數 x{large // small}，每輪耗時 x{ratio:.1f}（O(租戶數) 預期約 x{large // small}）")
+
+
+if __name__ == "__main__":
+    main()
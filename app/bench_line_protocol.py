@@ -0,0 +1,97 @@
+"""
+Line Protocol 快速路徑驗證與基準測試
+1. 確認 HostLineSerializer 輸出與 Point 路徑逐位元組相同
+2. 比較兩種序列化方式的耗時
+
+使用方式：python bench_line_protocol.py [租戶數]
+"""
+import sys
+import time
+from datetime import datetime, timezone
+
+from influxdb_client import Point, WritePrecision
+
+from line_protocol import HostLineSerializer, pinned_summary_line, to_ns
+
+# 涵蓋所有需要跳脫的字元
+TRICKY_NAMES = [
+    "KERRY TJ LOGISTICS",
+    "a,b=c d",
+    "tab\there",
+    "new\nline\rcr",
+    "trailing\\",
+    "中文租戶 名稱",
+    "quote\"name",
+    "",
+]
+
+
+def build_rows(n: int):
+    rows = []
+    for i in range(n):
+        name = TRICKY_NAMES[i % len(TRICKY_NAMES)] + (f" {i}" if i % 3 else "")
+        rows.append((f"{i:032x}", name, i * 7 % 1000, i % 5 == 0))
+    return rows
+
+
+def point_path(rows, parent_cid, ts) -> bytes:
+    lines = []
+    for cid, name, count, is_pinned in rows:
+        point = (
+            Point("crowdstrike_hosts")
+            .tag("cid", cid)
+            .tag("tenant_name", name)
+            .tag("is_pinned", str(is_pinned))
+            .tag("parent_cid", parent_cid)
+            .field("host_count", count)
+            .time(ts, WritePrecision.NS)
+        )
+        lines.append(point.to_line_protocol())
+    return "\n".join(lines).encode("utf-8")
+
+
+def verify(rows, parent_cid, ts) -> bool:
+    ok = True
+    expected = point_path(rows, parent_cid, ts)
+    serializer = HostLineSerializer()
+    for _ in range(2):   # 第二次走 tag set 快取
+        actual = serializer.serialize(rows, parent_cid, to_ns(ts))
+        ok &= actual == expected
+
+    summary = (
+        Point("crowdstrike_pinned_summary")
+        .tag("threshold", "375")
+        .field("total_count", 382)
+        .field("over_threshold", int(True))
+        .time(ts, WritePrecision.NS)
+    ).to_line_protocol()
+    ok &= pinned_summary_line(382, 375, True, ts_ns=to_ns(ts)) == summary
+    return ok
+
+
+def bench(n: int):
+    parent_cid = "p" * 32
+    rows = build_rows(n)
+    ts = datetime.now(timezone.utc)
+
+    if not verify(rows, parent_cid, ts):
+        print("  [✗] 快速路徑輸出與 Point 路徑不一致")
+        sys.exit(1)
+    print(f"  [✓] {n} 筆輸出與 Point 路徑逐位元組相同")
+
+    start = time.perf_counter()
+    point_path(rows, parent_cid, ts)
+    point_time = time.perf_counter() - start
+
+    serializer = HostLineSerializer()
+    serializer.serialize(rows, parent_cid, to_ns(ts))   # 暖快取
+    start = time.perf_counter()
+    serializer.serialize(rows, parent_cid, to_ns(ts))
+    fast_time = time.perf_counter() - start
+
+    print(f"  Point 路徑 : {point_time * 1000:8.2f} ms")
+    print(f"  快速路徑   : {fast_time * 1000:8.2f} ms  ({point_time / max(fast_time, 1e-9):.1f}x)")
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
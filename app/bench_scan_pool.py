@@ -0,0 +1,163 @@
+"""
+多行程掃描基準測試
+在獨立行程啟動一個模擬的 Falcon API（OAuth2 / 主機 scroll / 主機明細），
+以主機明細彙整模式掃描所有租戶，在 1、2、4、8 的併發數下分別比較執行緒池與
+行程池的耗時：兩者的網路等待同樣重疊，「行程/執行緒」即為繞過 GIL 的加速比。
+並確認各模式的結果與單行程一致。
+
+使用方式：python bench_scan_pool.py [租戶數，預設 64] [每租戶主機數，預設 2000]
+"""
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from scan_pool import PLATFORMS, ProcessScanPool, scan_tenant
+
+PROCESS_COUNTS = (1, 2, 4, 8)
+HTTP_POOL_CONFIG = {"pool_maxsize": 10, "pool_hosts": 20, "connect_timeout": 5.0,
+                    "read_timeout": 60.0, "proxy": None, "keepalive": True}
+
+
+# ── 模擬 Falcon API（回應預先序列化，伺服器端成本可忽略） ────────
+def _host(i: int) -> dict:
+    return {
+        "device_id": f"{i:032x}",
+        "hostname": f"HOST-{i:06d}",
+        "platform_name": PLATFORMS[i % len(PLATFORMS)],
+        "os_version": "Windows 11" if i % 4 == 0 else "Ubuntu 22.04",
+        "agent_version": "7.10.17706.0",
+        "serial_number": f"SN{i:010d}",
+        "mac_address": f"00-50-56-{i >> 16 & 255:02x}-{i >> 8 & 255:02x}-{i & 255:02x}",
+        "first_seen": "2026-01-01T00:00:00Z",
+        "last_seen": "2026-10-18T00:00:00Z",
+        "tags": ["FalconGroupingTags/Prod", "SensorGroupingTags/Default"],
+        "policies": [{"policy_type": "prevention", "policy_id": "p" * 32, "applied": True}],
+    }
+
+
+def _serve(hosts_per_tenant: int, ready):
+    ids = [f"{i:032x}" for i in range(hosts_per_tenant)]
+    scroll = json.dumps({"meta": {"pagination": {"total": hosts_per_tenant, "offset": ""}},
+                         "resources": ids}).encode()
+    count = json.dumps({"meta": {"pagination": {"total": hosts_per_tenant}},
+                        "resources": ids[:1]}).encode()
+    details = json.dumps({"meta": {}, "resources": [_host(i) for i in range(hosts_per_tenant)]}).encode()
+    token = json.dumps({"access_token": "t", "expires_in": 1799, "token_type": "bearer"}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        disable_nagle_algorithm = True
+
+        def _reply(self, status: int, body: bytes):
+            # 標頭與內容一次寫出，避免分段寫入卡在 Nagle / delayed ACK，讓耗時反映客戶端運算而非網路等待
+            head = (f"HTTP/1.1 {status} {self.responses[status][0]}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode()
+            self.wfile.write(head + body)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.path.startswith("/oauth2/token"):
+                self._reply(201, token)
+            else:
+                self._reply(200, details)
+
+        def do_GET(self):
+            limit = parse_qs(urlparse(self.path).query).get("limit", ["0"])[0]
+            self._reply(200, count if limit == "1" else scroll)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    ready.put(server.server_port)
+    server.serve_forever()
+
+
+def start_stub(hosts_per_tenant: int):
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Queue()
+    proc = ctx.Process(target=_serve, args=(hosts_per_tenant, ready), daemon=True)
+    proc.start()
+    return proc, f"http://127.0.0.1:{ready.get(timeout=30)}"
+
+
+# ── 測試 ──────────────────────────────────────────────────────
+def scan_serial(creds, cids):
+    from falconpy import Hosts
+
+    from http_pool import ConnectionPool
+
+    pool = ConnectionPool(**HTTP_POOL_CONFIG)
+    pool.install_falconpy()
+    start = time.perf_counter()
+    results = {cid: scan_tenant(lambda c: Hosts(**creds, member_cid=c), cid, breakdown=True)
+               for cid in cids}
+    elapsed = time.perf_counter() - start
+    pool.close()
+    return results, elapsed
+
+
+def scan_threads(creds, cids, threads: int):
+    """同併發數的執行緒池基準：網路等待同樣重疊，差異只剩 GIL 下的運算"""
+    from falconpy import Hosts
+
+    from http_pool import ConnectionPool
+
+    pool = ConnectionPool(**HTTP_POOL_CONFIG)
+    pool.install_falconpy()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        scans = executor.map(lambda c: scan_tenant(lambda m: Hosts(**creds, member_cid=m), c, breakdown=True),
+                             cids)
+        results = dict(zip(cids, scans))
+    elapsed = time.perf_counter() - start
+    pool.close()
+    return results, elapsed
+
+
+def scan_processes(creds, cids, processes: int):
+    pool = ProcessScanPool(processes, creds, "p" * 32, HTTP_POOL_CONFIG, breakdown=True, chunk_size=2)
+    try:
+        # 以不在測試清單中的租戶暖機：worker 完成啟動與 import，但不預先快取受測租戶的 Hosts / token
+        list(pool.scan([f"warmup-{i}" for i in range(processes * pool.chunk_size)]))
+        start = time.perf_counter()
+        results = dict(pool.scan(cids))
+        return results, time.perf_counter() - start
+    finally:
+        pool.close()
+
+
+def main():
+    tenants = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    hosts = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    stub, url = start_stub(hosts)
+    creds = {"client_id": "x", "client_secret": "y", "base_url": url}
+    cids = [f"{i:032x}" for i in range(tenants)]
+
+    print("=" * 70)
+    print(f"  多行程掃描基準測試  {tenants} 租戶 x {hosts} 台主機（CPU: {os.cpu_count()}）")
+    print("=" * 70)
+    try:
+        expected, baseline = scan_serial(creds, cids)
+        print(f"  單行程（原路徑）  {baseline:8.2f} s")
+        print("  併發    執行緒      行程   行程/單行程  行程/執行緒")
+        for n in PROCESS_COUNTS:
+            threaded, t_elapsed = scan_threads(creds, cids, n)
+            results, p_elapsed = scan_processes(creds, cids, n)
+            same = all((r[c].count, r[c].platforms) == (expected[c].count, expected[c].platforms)
+                       for r in (threaded, results) for c in cids)
+            print(f"  {n:>4}  {t_elapsed:7.2f}s  {p_elapsed:7.2f}s  x{baseline / p_elapsed:5.2f}      "
+                  f"x{t_elapsed / p_elapsed:5.2f}      {'[✓] 結果一致' if same else '[✗] 結果不一致'}")
+    finally:
+        stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+啟動時間基準測試
+在全新的直譯器中量測：
+  - import monitor 耗時
+  - 建立 MSSPMonitor 耗時
+  - 到第一次 CrowdStrike API 呼叫（OAuth2 token）完成的總耗時
+  - 實際被載入的 SDK
+
+並與「一次 import 全部 SDK」的舊行為比較。
+
+使用方式：python bench_startup.py [重複次數]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SDKS = ["falconpy", "influxdb_client", "prometheus_client"]
+
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import monitor
+t_import = time.perf_counter()
+m = monitor.MSSPMonitor()
+t_init = time.perf_counter()
+try:
+    m.auth.token()
+except Exception:
+    pass
+t_api = time.perf_counter()
+print(json.dumps({
+    "import": t_import - t0,
+    "init": t_init - t_import,
+    "first_api": t_api - t0,
+    "loaded": [s for s in %r if s in sys.modules],
+}))
+"""
+
+EAGER = r"""
+import json, time
+t0 = time.perf_counter()
+import falconpy, influxdb_client, prometheus_client
+from influxdb_client.client.write_api import SYNCHRONOUS
+print(json.dumps({"import": time.perf_counter() - t0}))
+"""
+
+MODES = {
+    "全部啟用": {},
+    "只啟用 InfluxDB": {"PROMETHEUS_ENABLED": "false"},
+    "只啟用 Prometheus": {"INFLUXDB_ENABLED": "false"},
+}
+
+
+def run_child(code: str, extra_env: dict) -> dict:
+    env = dict(os.environ, LOG_FILE=os.path.join(tempfile.gettempdir(), "bench_startup.log"))
+    env.update(extra_env)
+    out = subprocess.run([sys.executable, "-c", code], cwd=HERE, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def bench(repeat: int):
+    eager = median([run_child(EAGER, {})["import"] for _ in range(repeat)])
+    print(f"  舊行為（import 全部 SDK）: {eager * 1000:8.1f} ms")
+    print()
+
+    for label, env in MODES.items():
+        runs = [run_child(CHILD % SDKS, env) for _ in range(repeat)]
+        print(f"  ▶ {label}")
+        print(f"    import monitor      : {median([r['import'] for r in runs]) * 1000:8.1f} ms")
+        print(f"    建立 MSSPMonitor    : {median([r['init'] for r in runs]) * 1000:8.1f} ms")
+        print(f"    到第一次 API 呼叫   : {median([r['first_api'] for r in runs]) * 1000:8.1f} ms")
+        print(f"    已載入 SDK          : {', '.join(runs[-1]['loaded']) or '-'}")
+        print()
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
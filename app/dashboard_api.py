@@ -0,0 +1,288 @@
+"""
+Dashboard 摘要 API
+每輪掃描結束時預先計算 Grafana 總覽所需的聚合值，
+以 SimpleJSON 相容的 HTTP 端點提供，面板刷新不再回頭查 InfluxDB。
+
+另提供掃描進度串流（見 scan_events.py）：
+  GET /scan/status     目前掃描狀態
+  GET /scan/snapshot   上一輪完整結果
+  GET /scan/partial    本輪已完成的租戶
+  GET /scan/events     Server-Sent Events 即時串流（支援 Last-Event-ID）
+  GET /scan/stream     JSON lines 即時串流
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from scan_events import ScanEventBus
+
+logger = logging.getLogger(__name__)
+
+# 預設保留 24 小時的掃描歷史，用來計算 24h 變化量
+HISTORY_WINDOW = 24 * 3600
+TOP_N = 10
+# 串流連線的心跳間隔（秒），也是檢查伺服器是否關閉的週期
+STREAM_HEARTBEAT = 15
+
+
+class SummaryCache:
+    """每輪掃描更新一次的摘要快取（回應內容預先序列化）"""
+
+    def __init__(self, history_window: int = HISTORY_WINDOW):
+        self.history_window = history_window
+        self.version = 0
+        self._lock = threading.Lock()
+        self._history = deque()      # (timestamp, {cid: count}, pinned_total)
+        self._summary: Dict = {}
+        self._summary_bytes = b"{}"
+        self._targets: Dict[str, bytes] = {}
+
+    def update(self, tenant_map: Dict[str, str], new_data: Dict[str, int],
+               pinned_list: List[str], threshold: int, scanned_at: Optional[float] = None):
+        """以本輪掃描結果重建所有聚合值，並讓舊快取失效"""
+        now = scanned_at if scanned_at is not None else time.time()
+        pinned_total = sum(new_data.get(cid, 0) for cid in pinned_list)
+
+        # ── 維護 24h 歷史 ─────────────────────────────────────────
+        self._history.append((now, dict(new_data), pinned_total))
+        while self._history and self._history[0][0] < now - self.history_window:
+            self._history.popleft()
+        base_data = self._history[0][1]
+        base_pinned = self._history[0][2]
+
+        # ── 租戶明細（依端點數遞減） ─────────────────────────────
+        tenants = []
+        for cid, name in tenant_map.items():
+            count = new_data.get(cid, 0)
+            tenants.append({
+                "tenant_name": name,
+                "cid": cid,
+                "is_pinned": cid in pinned_list,
+                "host_count": count,
+                "change_24h": count - base_data.get(cid, count),
+            })
+        tenants.sort(key=lambda t: t["host_count"], reverse=True)
+
+        ts_ms = int(now * 1000)
+        usage_percent = round(pinned_total / max(threshold, 1) * 100, 2)
+        summary = {
+            "version": self.version + 1,
+            "scanned_at": ts_ms,
+            "threshold": threshold,
+            "pinned_total": pinned_total,
+            "pinned_usage_percent": usage_percent,
+            "pinned_change_24h": pinned_total - base_pinned,
+            "over_threshold": pinned_total > threshold,
+            "tenant_count": len(tenants),
+            "total_hosts": sum(t["host_count"] for t in tenants),
+            "top_tenants": tenants[:TOP_N],
+            "pinned_tenants": [t for t in tenants if t["is_pinned"]],
+            "tenants": tenants,
+        }
+
+        # ── 預先序列化每個 SimpleJSON target ──────────────────────
+        targets = {
+            "pinned_total": _timeserie("pinned_total",
+                                       [[p, int(t * 1000)] for t, _, p in self._history]),
+            "pinned_usage_percent": _timeserie("pinned_usage_percent", [[usage_percent, ts_ms]]),
+            "pinned_change_24h": _timeserie("pinned_change_24h",
+                                            [[summary["pinned_change_24h"], ts_ms]]),
+            "total_hosts": _timeserie("total_hosts", [[summary["total_hosts"], ts_ms]]),
+            "tenant_table": _table(tenants),
+            "top_tenants": _table(tenants[:TOP_N]),
+        }
+
+        with self._lock:
+            self.version += 1
+            self._summary = summary
+            self._summary_bytes = json.dumps(summary, ensure_ascii=False).encode("utf-8")
+            self._targets = {k: json.dumps(v, ensure_ascii=False).encode("utf-8")
+                             for k, v in targets.items()}
+
+    def seed(self, counts: Dict[str, int], pinned_list: List[str], scanned_at: float):
+        """以重啟前最後一輪的結果作為歷史起點（超出保留視窗則略過）"""
+        if scanned_at < time.time() - self.history_window:
+            return
+        pinned_total = sum(counts.get(cid, 0) for cid in pinned_list)
+        self._history.append((scanned_at, dict(counts), pinned_total))
+
+    @property
+    def summary(self) -> Dict:
+        return self._summary
+
+    def summary_bytes(self) -> bytes:
+        return self._summary_bytes
+
+    def target_names(self) -> List[str]:
+        return sorted(self._targets)
+
+    def query(self, names: List[str]) -> bytes:
+        """組合已序列化的 target 回應，不做任何重新計算"""
+        targets = self._targets
+        parts = [targets[n] for n in names if n in targets]
+        return b"[" + b",".join(parts) + b"]"
+
+
+def _timeserie(name: str, datapoints: List[List]) -> Dict:
+    return {"target": name, "datapoints": datapoints}
+
+
+def _table(rows: List[Dict]) -> Dict:
+    return {
+        "type": "table",
+        "columns": [
+            {"text": "tenant_name", "type": "string"},
+            {"text": "cid", "type": "string"},
+            {"text": "is_pinned", "type": "string"},
+            {"text": "host_count", "type": "number"},
+            {"text": "change_24h", "type": "number"},
+        ],
+        "rows": [
+            [r["tenant_name"], r["cid"], str(r["is_pinned"]), r["host_count"], r["change_24h"]]
+            for r in rows
+        ],
+    }
+
+
+class _DashboardHandler(BaseHTTPRequestHandler):
+    """SimpleJSON 協定：GET / 、POST /search 、POST /query 、POST /annotations"""
+
+    cache: SummaryCache = None
+    events: Optional[ScanEventBus] = None
+    stopping: threading.Event = None
+
+    def _send(self, body: bytes, status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", f'"{self.cache.version}"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def _send_json(self, obj, status: int = 200):
+        self._send(json.dumps(obj, ensure_ascii=False).encode("utf-8"), status=status)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith("/scan/"):
+            self._handle_scan(url.path, parse_qs(url.query))
+        elif url.path == "/":
+            self._send(b'{"status": "ok"}')
+        elif url.path == "/summary":
+            if self.headers.get("If-None-Match") == f'"{self.cache.version}"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            self._send(self.cache.summary_bytes())
+        else:
+            self._send(b'{"error": "not found"}', status=404)
+
+    # ── 掃描進度 ──────────────────────────────────────────────
+    def _handle_scan(self, path: str, query: Dict):
+        if self.events is None:
+            self._send(b'{"error": "scan events disabled"}', status=404)
+        elif path == "/scan/status":
+            self._send_json(self.events.status())
+        elif path == "/scan/snapshot":
+            self._send_json(self.events.last_snapshot())
+        elif path == "/scan/partial":
+            self._send_json(self.events.partial_results())
+        elif path in ("/scan/events", "/scan/stream"):
+            last_id = self.headers.get("Last-Event-ID") or (query.get("last_event_id") or [None])[0]
+            try:
+                last_id = int(last_id) if last_id is not None else None
+            except ValueError:
+                last_id = None
+            self._stream(sse=(path == "/scan/events"), last_event_id=last_id)
+        else:
+            self._send(b'{"error": "not found"}', status=404)
+
+    def _stream(self, sse: bool, last_event_id: Optional[int]):
+        """持續推送事件直到客戶端斷線或伺服器關閉"""
+        sub = self.events.subscribe(last_event_id)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if sse else "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("X-Accel-Buffering", "no")
+        self.end_headers()
+        try:
+            # 先送出目前狀態，訂閱者不必另外查詢
+            self._write_event({"id": 0, "event": "status", "time": time.time(),
+                               "data": self.events.status()}, sse)
+            while not self.stopping.is_set():
+                event = sub.get(timeout=STREAM_HEARTBEAT)
+                if event is None:
+                    if sse:
+                        self.wfile.write(b": keep-alive\n\n")
+                    else:
+                        # JSON lines 每行都必須是完整的 JSON 物件
+                        heartbeat = {"event": "heartbeat", "time": time.time()}
+                        self.wfile.write(json.dumps(heartbeat).encode("utf-8") + b"\n")
+                else:
+                    self._write_event(event, sse)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            sub.close()
+
+    def _write_event(self, event: Dict, sse: bool):
+        payload = json.dumps(event if not sse else event["data"], ensure_ascii=False)
+        if sse:
+            # 狀態事件不帶 id，避免重連時 Last-Event-ID 被歸零
+            event_id = f"id: {event['id']}\n" if event["id"] else ""
+            chunk = f"{event_id}event: {event['event']}\ndata: {payload}\n\n"
+        else:
+            chunk = payload + "\n"
+        self.wfile.write(chunk.encode("utf-8"))
+        self.wfile.flush()
+
+    def do_POST(self):
+        payload = self._read_json()
+        if self.path == "/search":
+            self._send(json.dumps(self.cache.target_names()).encode("utf-8"))
+        elif self.path == "/query":
+            names = [t.get("target") for t in payload.get("targets", []) if t.get("target")]
+            self._send(self.cache.query(names))
+        elif self.path == "/annotations":
+            self._send(b"[]")
+        else:
+            self._send(b'{"error": "not found"}', status=404)
+
+    def log_message(self, format, *args):
+        logger.debug("Dashboard API: " + format, *args)
+
+
+def start_dashboard_api(cache: SummaryCache, host: str, port: int,
+                        events: Optional[ScanEventBus] = None) -> ThreadingHTTPServer:
+    """在背景執行緒啟動摘要 API（串流連線在 server.shutdown() 後最多 STREAM_HEARTBEAT 秒內結束）"""
+    stopping = threading.Event()
+    handler = type("DashboardHandler", (_DashboardHandler,),
+                   {"cache": cache, "events": events, "stopping": stopping})
+    server = ThreadingHTTPServer((host, port), handler)
+    shutdown = server.shutdown
+
+    def shutdown_with_streams():
+        stopping.set()
+        shutdown()
+
+    server.shutdown = shutdown_with_streams
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="dashboard-api", daemon=True)
+    thread.start()
+    logger.info(f"Dashboard API 已啟動: http://{host}:{port}")
+    return server
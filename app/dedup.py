@@ -0,0 +1,266 @@
+"""
+跨租戶主機去重
+主機在子 CID 之間搬移或重灌後，7 天視窗內可能同時被兩個租戶計入，
+使 Pinned 總計虛增。此模組把各租戶的主機識別（序號 / MAC / device ID 雜湊）
+串流寫入精簡的集合 sketch：
+  - 小租戶：排序後的 64-bit 雜湊陣列（精確）
+  - 大租戶：HyperLogLog（p=14，16 KB，誤差約 0.8%）
+sketch 可做聯集，依日期存檔後可查詢任意時間視窗的唯一主機數。
+"""
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from host_inventory import iter_host_details
+
+logger = logging.getLogger(__name__)
+
+HLL_PRECISION = 14
+EXACT_LIMIT = 4096          # 超過此數量即轉為 HyperLogLog
+_MASK64 = (1 << 64) - 1
+
+# 廠商預設 / 無意義的序號，不能拿來當識別
+_PLACEHOLDER_SERIALS = {
+    "", "0", "none", "n/a", "na", "default string", "system serial number",
+    "to be filled by o.e.m.", "not specified", "not applicable", "0123456789",
+}
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def host_key(host: Dict) -> Optional[int]:
+    """
+    主機識別雜湊：優先使用硬體序號（重灌後不變），其次 MAC，最後 device ID。
+    """
+    serial = (host.get("serial_number") or "").strip()
+    if serial.lower() not in _PLACEHOLDER_SERIALS:
+        return _hash64(f"serial:{serial.upper()}")
+    mac = (host.get("mac_address") or "").strip()
+    if mac:
+        return _hash64(f"mac:{mac.lower().replace('-', ':')}")
+    device_id = host.get("device_id")
+    if device_id:
+        return _hash64(f"aid:{device_id.lower()}")
+    return None
+
+
+class HostSketch:
+    """精確集合 / HyperLogLog 混合 sketch，記憶體上限固定"""
+
+    def __init__(self, precision: int = HLL_PRECISION, exact_limit: int = EXACT_LIMIT):
+        self.precision = precision
+        self.exact_limit = exact_limit
+        self._exact: Optional[set] = set()
+        self._registers: Optional[bytearray] = None
+
+    @property
+    def is_exact(self) -> bool:
+        return self._exact is not None
+
+    def add(self, value: int):
+        if self._exact is not None:
+            self._exact.add(value)
+            if len(self._exact) > self.exact_limit:
+                self._promote()
+        else:
+            self._add_hll(value)
+
+    def update(self, values: Iterable[int]):
+        for value in values:
+            self.add(value)
+
+    def _promote(self):
+        self._registers = bytearray(1 << self.precision)
+        exact, self._exact = self._exact, None
+        for value in exact:
+            self._add_hll(value)
+
+    def _add_hll(self, value: int):
+        p = self.precision
+        idx = value >> (64 - p)
+        rest = (value << p) & _MASK64
+        rank = (64 - rest.bit_length()) + 1 if rest else 64 - p + 1
+        if rank > self._registers[idx]:
+            self._registers[idx] = rank
+
+    def merge(self, other: "HostSketch") -> "HostSketch":
+        """就地聯集"""
+        if other._exact is not None:
+            self.update(other._exact)
+            return self
+        if self._exact is not None:
+            self._promote()
+        if other.precision != self.precision:
+            raise ValueError("HyperLogLog precision 不一致，無法聯集")
+        regs = self._registers
+        for i, r in enumerate(other._registers):
+            if r > regs[i]:
+                regs[i] = r
+        return self
+
+    @property
+    def relative_error(self) -> float:
+        """基數估計的相對標準誤差：精確集合為 0，HyperLogLog 約 1.04/√m"""
+        return 0.0 if self._exact is not None else 1.04 / math.sqrt(1 << self.precision)
+
+    def copy(self) -> "HostSketch":
+        return HostSketch(self.precision, self.exact_limit).merge(self)
+
+    def cardinality(self) -> int:
+        if self._exact is not None:
+            return len(self._exact)
+        m = len(self._registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self._registers)
+        zeros = self._registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)   # 小範圍修正（linear counting）
+        return int(round(estimate))
+
+    # ── 序列化 ────────────────────────────────────────────────
+    def to_bytes(self) -> bytes:
+        if self._exact is not None:
+            return b"E" + array("Q", sorted(self._exact)).tobytes()
+        return b"H" + bytes([self.precision]) + bytes(self._registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, exact_limit: int = EXACT_LIMIT) -> "HostSketch":
+        if data[:1] == b"E":
+            sketch = cls(exact_limit=exact_limit)
+            values = array("Q")
+            values.frombytes(data[1:])
+            sketch._exact = set(values)
+            return sketch
+        if data[:1] == b"H":
+            sketch = cls(precision=data[1], exact_limit=exact_limit)
+            sketch._exact = None
+            sketch._registers = bytearray(data[2:])
+            return sketch
+        raise ValueError("無法辨識的 sketch 格式")
+
+
+def union_all(sketches: Iterable[HostSketch]) -> HostSketch:
+    result = HostSketch()
+    for sketch in sketches:
+        result.merge(sketch)
+    return result
+
+
+class SketchStore:
+    """依日期保存各租戶 sketch：<dir>/<YYYY-MM-DD>.json = {cid: base64}"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, day: date) -> str:
+        return os.path.join(self.directory, f"{day.isoformat()}.json")
+
+    def save(self, day: date, sketches: Dict[str, HostSketch]):
+        path = self._path(day)
+        payload = self._read(path)
+        payload.update({cid: base64.b64encode(s.to_bytes()).decode("ascii") for cid, s in sketches.items()})
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(payload, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _read(self, path: str) -> Dict[str, str]:
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def load_window(self, cids: List[str], start: date, end: date) -> Dict[str, HostSketch]:
+        """各 CID 在 [start, end] 期間的聯集 sketch"""
+        result: Dict[str, HostSketch] = {}
+        day = start
+        while day <= end:
+            for cid, encoded in self._read(self._path(day)).items():
+                if cid not in cids:
+                    continue
+                sketch = HostSketch.from_bytes(base64.b64decode(encoded))
+                if cid in result:
+                    result[cid].merge(sketch)
+                else:
+                    result[cid] = sketch
+            day += timedelta(days=1)
+        return result
+
+
+def overlap_report(sketches: Dict[str, HostSketch]) -> Dict:
+    """
+    唯一主機數、重複數與兩兩重疊。
+    兩邊都是精確集合時直接取交集；任一邊為 HyperLogLog 時以 |A| + |B| - |A∪B| 估計，
+    誤差範圍取三個估計值的 relative_error × 基數之和，不超過的重疊視為雜訊不列出（只計數）。
+    overlaps 為 (cid_a, cid_b, 重疊數, 誤差範圍) 列表，誤差範圍 0 表示精確值。
+    """
+    sizes = {cid: s.cardinality() for cid, s in sketches.items()}
+    unique = union_all(sketches.values()).cardinality()
+    pairs = []
+    suppressed = 0
+    for a, b in combinations(sorted(sketches), 2):
+        sa, sb = sketches[a], sketches[b]
+        if sa.is_exact and sb.is_exact:
+            shared, error = len(sa._exact & sb._exact), 0
+        else:
+            union = sa.copy().merge(sb).cardinality()
+            shared = sizes[a] + sizes[b] - union
+            # 三個估計值的誤差相加（精確集合那一邊為 0），避免兩個大租戶的估計差被當成重疊
+            error = int(math.ceil(sa.relative_error * sizes[a] + sb.relative_error * sizes[b]
+                                  + max(sa.relative_error, sb.relative_error) * union))
+            if shared <= error:
+                suppressed += shared > 0
+                continue
+        if shared:
+            pairs.append((a, b, shared, error))
+    pairs.sort(key=lambda x: x[2], reverse=True)
+    raw_total = sum(sizes.values())
+    return {
+        "sizes": sizes,
+        "raw_total": raw_total,
+        "unique_total": unique,
+        "duplicates": max(raw_total - unique, 0),
+        "overlaps": pairs,
+        "suppressed_overlaps": suppressed,
+        "exact": all(s.is_exact for s in sketches.values()),
+    }
+
+
+class DedupScanner:
+    """串流讀取各租戶主機並建立 sketch"""
+
+    def __init__(self, creds: Dict, parent_cid: str, workers: int = 4,
+                 fql_filter: str = "last_seen:>'now-7d'"):
+        self.creds = creds
+        self.parent_cid = parent_cid
+        self.workers = max(workers, 1)
+        self.fql_filter = fql_filter
+
+    def build_sketch(self, cid: str) -> Tuple[HostSketch, int]:
+        """回傳 (sketch, API 回傳的主機筆數)"""
+        from falconpy import Hosts
+
+        is_parent = (cid == self.parent_cid)
+        hosts_api = Hosts(**self.creds, member_cid=None if is_parent else cid)
+        sketch = HostSketch()
+        seen = 0
+        for host in iter_host_details(hosts_api, self.fql_filter):
+            seen += 1
+            key = host_key(host)
+            if key is not None:
+                sketch.add(key)
+        return sketch, seen
+
+    def scan(self, cids: List[str]) -> Dict[str, Tuple[HostSketch, int]]:
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return dict(zip(cids, pool.map(self.build_sketch, cids)))
@@ -0,0 +1,55 @@
+"""
+主機清單批次讀取
+以 scroll API 分頁取得 device ID，再以每批最多 5000 筆查詢主機明細。
+"""
+import logging
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SCROLL_LIMIT = 5000
+DETAILS_BATCH = 5000
+
+
+def iter_host_ids(hosts_api, fql_filter: Optional[str] = None) -> Iterator[List[str]]:
+    """逐頁產生 device ID（每頁一個 list）"""
+    offset = None
+    while True:
+        kwargs = {"limit": SCROLL_LIMIT}
+        if fql_filter:
+            kwargs["filter"] = fql_filter
+        if offset:
+            kwargs["offset"] = offset
+        resp = hosts_api.query_devices_by_filter_scroll(**kwargs)
+        if resp["status_code"] != 200:
+            raise RuntimeError(f"query_devices_by_filter_scroll 失敗: {resp['status_code']}")
+
+        ids = resp["body"].get("resources") or []
+        if ids:
+            yield ids
+        pagination = resp["body"].get("meta", {}).get("pagination", {})
+        offset = pagination.get("offset")
+        if not ids or not offset:
+            break
+
+
+def iter_host_details(hosts_api, fql_filter: Optional[str] = None) -> Iterator[Dict]:
+    """逐筆產生主機明細"""
+    for page in iter_host_ids(hosts_api, fql_filter):
+        for i in range(0, len(page), DETAILS_BATCH):
+            resp = hosts_api.get_device_details(ids=page[i:i + DETAILS_BATCH])
+            if resp["status_code"] != 200:
+                raise RuntimeError(f"get_device_details 失敗: {resp['status_code']}")
+            yield from resp["body"].get("resources") or []
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[float]:
+    """Falcon ISO 8601 時間字串轉 epoch 秒"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        logger.debug(f"無法解析時間: {value}")
+        return None
@@ -0,0 +1,155 @@
+"""
+共用 HTTP 連線池
+falconpy、InfluxDB 與 Pushgateway 的連線設定（每主機連線數、keep-alive、
+proxy、逾時）集中在此，並統計連線重用與 TLS handshake 次數，
+用來確認一輪數百個租戶的掃描只開了少數幾條 socket。
+urllib3 的計數只增不減，且主機數超過 pool_hosts 被淘汰的連線池會帶走自己的計數；
+此處把淘汰前的計數併入累計值，每輪的數字由呼叫端以 summary() 前後相減取得。
+
+HTTP/2：requests / urllib3 / influxdb_client 目前都只支援 HTTP/1.1，
+此處以 keep-alive 連線重用達成相同目的。
+"""
+import logging
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _PooledRequests:
+    """取代 falconpy 內部的 requests 模組：request() 改走共用 Session，其餘屬性照舊"""
+
+    def __init__(self, module, session):
+        self._module = module
+        self._session = session
+
+    def request(self, method, url, **kwargs):
+        return self._session.request(method, url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+
+class ConnectionPool:
+    """所有對外 HTTP 客戶端共用的連線設定與統計"""
+
+    def __init__(self, pool_maxsize: int = 10, pool_hosts: int = 20,
+                 connect_timeout: float = 5.0, read_timeout: float = 30.0,
+                 proxy: Optional[str] = None, keepalive: bool = True):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.proxy = proxy or None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if self.proxy:
+            self.session.proxies = {"http": self.proxy, "https": self.proxy}
+        if not keepalive:
+            self.session.headers["Connection"] = "close"
+
+        self._lock = threading.Lock()
+        self._pool_managers: Dict[str, object] = {}
+        self._retired: Dict[str, Dict[str, int]] = {}   # 已淘汰連線池的累計計數
+        self.register("http", adapter.poolmanager)
+
+    # ── 注入各客戶端 ──────────────────────────────────────────
+    def install_falconpy(self):
+        """讓 falconpy 所有 API 呼叫共用此連線池（falconpy 預設每次呼叫都新建連線）"""
+        from falconpy._util import _functions
+
+        if not isinstance(_functions.requests, _PooledRequests):
+            _functions.requests = _PooledRequests(_functions.requests, self.session)
+
+    def falcon_kwargs(self) -> Dict:
+        """falconpy Service Class 建構參數"""
+        kwargs = {"timeout": (self.connect_timeout, self.read_timeout)}
+        if self.proxy:
+            kwargs["proxy"] = {"http": self.proxy, "https": self.proxy}
+        return kwargs
+
+    def influx_kwargs(self) -> Dict:
+        """InfluxDBClient 建構參數（逾時單位為毫秒）"""
+        kwargs = {
+            "timeout": int((self.connect_timeout + self.read_timeout) * 1000),
+            "connection_pool_maxsize": self.pool_maxsize,
+        }
+        if self.proxy:
+            kwargs["proxy"] = self.proxy
+        return kwargs
+
+    def prometheus_handler(self) -> Callable:
+        """push_to_gateway 的 handler，改用共用 Session 推送"""
+        session = self.session
+
+        def handler(url: str, method: str, timeout: Optional[float], headers, data: bytes):
+            def handle():
+                resp = session.request(method, url, data=data, headers=dict(headers),
+                                       timeout=timeout or self.read_timeout)
+                if resp.status_code >= 400:
+                    raise IOError(f"Pushgateway 回應錯誤: {resp.status_code} {resp.text[:200]}")
+            return handle
+
+        return handler
+
+    def register(self, name: str, pool_manager):
+        """登記其他客戶端自己的 urllib3 PoolManager，納入統計"""
+        with self._lock:
+            self._pool_managers[name] = pool_manager
+            self._retired.setdefault(name, {"connections": 0, "requests": 0, "tls_handshakes": 0})
+        dispose = pool_manager.pools.dispose_func
+
+        def on_evict(pool):
+            self._retire(name, pool)
+            if dispose:
+                dispose(pool)
+
+        pool_manager.pools.dispose_func = on_evict
+
+    def _retire(self, name: str, pool):
+        with self._lock:
+            retired = self._retired[name]
+            retired["connections"] += pool.num_connections
+            retired["requests"] += pool.num_requests
+            if pool.scheme == "https":
+                retired["tls_handshakes"] += pool.num_connections
+
+    # ── 統計 ──────────────────────────────────────────────────
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """各 PoolManager 自建立以來的 {connections, requests, reused, tls_handshakes}（含已淘汰的連線池）"""
+        result = {}
+        with self._lock:
+            managers = [(name, manager, dict(self._retired[name]))
+                        for name, manager in self._pool_managers.items()]
+        for name, manager, retired in managers:
+            connections, requests, tls = retired["connections"], retired["requests"], retired["tls_handshakes"]
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                connections += pool.num_connections
+                requests += pool.num_requests
+                if pool.scheme == "https":
+                    tls += pool.num_connections
+            result[name] = {
+                "connections": connections,
+                "requests": requests,
+                "reused": max(requests - connections, 0),
+                "tls_handshakes": tls,
+            }
+        return result
+
+    def summary(self) -> Tuple[int, int, int]:
+        """自建立以來的 (總連線數, 總請求數, 總 TLS handshake 數)"""
+        stats = self.stats().values()
+        return (sum(s["connections"] for s in stats),
+                sum(s["requests"] for s in stats),
+                sum(s["tls_handshakes"] for s in stats))
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,103 @@
+"""
+InfluxDB Line Protocol 快速序列化
+直接由租戶快照產生 line protocol，不逐筆建立 Point 物件。
+跳脫規則與 influxdb_client.Point.to_line_protocol() 完全一致。
+"""
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+HOSTS_MEASUREMENT = "crowdstrike_hosts"
+PINNED_SUMMARY_MEASUREMENT = "crowdstrike_pinned_summary"
+
+_ESCAPE_MEASUREMENT = str.maketrans({
+    ',': r'\,',
+    ' ': r'\ ',
+    '\n': r'\n',
+    '\t': r'\t',
+    '\r': r'\r',
+})
+
+_ESCAPE_KEY = str.maketrans({
+    ',': r'\,',
+    '=': r'\=',
+    ' ': r'\ ',
+    '\n': r'\n',
+    '\t': r'\t',
+    '\r': r'\r',
+})
+
+
+def escape_tag_value(value) -> str:
+    ret = str(value).translate(_ESCAPE_KEY)
+    if ret.endswith('\\'):
+        ret += ' '
+    return ret
+
+
+def tag_set(tags: Dict[str, object]) -> str:
+    """依 key 排序組合 tag set（含開頭逗號），空值與 None 略過"""
+    parts = []
+    for key, value in sorted(tags.items()):
+        if value is None:
+            continue
+        k = str(key).translate(_ESCAPE_KEY)
+        v = escape_tag_value(value)
+        if k != '' and v != '':
+            parts.append(f'{k}={v}')
+    return f"{',' if parts else ''}{','.join(parts)}"
+
+
+def to_ns(dt: datetime) -> int:
+    """datetime 轉 epoch 奈秒（與 Point 使用相同的整數運算，避免浮點誤差）"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt.astimezone(timezone.utc) - EPOCH
+    return delta.days * 86400 * 10 ** 9 + delta.seconds * 10 ** 9 + delta.microseconds * 10 ** 3
+
+
+class HostLineSerializer:
+    """crowdstrike_hosts 序列化器，依 CID 快取已跳脫的 measurement + tag set"""
+
+    def __init__(self):
+        self._measurement = HOSTS_MEASUREMENT.translate(_ESCAPE_MEASUREMENT)
+        # cid -> ((tenant_name, is_pinned, parent_cid), prefix)
+        self._prefix_cache: Dict[str, Tuple[Tuple, str]] = {}
+
+    def _prefix(self, cid: str, tenant_name: str, is_pinned: bool, parent_cid: str) -> str:
+        key = (tenant_name, is_pinned, parent_cid)
+        cached = self._prefix_cache.get(cid)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        prefix = self._measurement + tag_set({
+            "cid": cid,
+            "tenant_name": tenant_name,
+            "is_pinned": str(is_pinned),
+            "parent_cid": parent_cid,
+        }) + " host_count="
+        self._prefix_cache[cid] = (key, prefix)
+        return prefix
+
+    def line(self, cid: str, tenant_name: str, count: int, is_pinned: bool,
+             parent_cid: str, ts_ns: int) -> str:
+        return f"{self._prefix(cid, tenant_name, is_pinned, parent_cid)}{int(count)}i {ts_ns}"
+
+    def serialize(self, rows: Iterable[Tuple[str, str, int, bool]], parent_cid: str,
+                  ts_ns: int) -> bytes:
+        """rows: (cid, tenant_name, count, is_pinned)，整批輸出為換行分隔的 bytes"""
+        return "\n".join(
+            self.line(cid, name, count, is_pinned, parent_cid, ts_ns)
+            for cid, name, count, is_pinned in rows
+        ).encode("utf-8")
+
+
+def pinned_summary_line(total: int, threshold: int, over_threshold: bool,
+                        ts_ns: Optional[int] = None) -> str:
+    """crowdstrike_pinned_summary 單筆 line protocol"""
+    measurement = PINNED_SUMMARY_MEASUREMENT.translate(_ESCAPE_MEASUREMENT)
+    tags = tag_set({"threshold": str(threshold)})
+    line = f"{measurement}{tags} over_threshold={int(over_threshold)}i,total_count={int(total)}i"
+    if ts_ns is not None:
+        line += f" {ts_ns}"
+    return line
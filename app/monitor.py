@@ -1,28 +1,33 @@
 """
 CrowdStrike MSSP Monitor v2.0
 支援 InfluxDB + Prometheus 雙寫
+
+falconpy / influxdb_client / prometheus_client 皆延遲載入，
+只有實際啟用的後端才會被 import。
+
+使用方式：
+  python monitor.py          # 常駐循環掃描
+  python monitor.py --once   # 只掃描一次後結束（cron / Kubernetes Job）
+  python monitor.py --backfill-from 2026-10-01 --backfill-to 2026-10-07
+                             # 以主機 first_seen / last_seen 回補歷史資料
+  python monitor.py --dedup [--dedup-days 30]
+                             # Pinned CIDs 跨租戶主機去重報告
 """
+import argparse
 import json
 import os
 import time
 import sys
 import logging
-from datetime import datetime, timezone
-from typing import Dict, List, Tuple
-from falconpy import Hosts, FlightControl, OAuth2
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS
-from prometheus_client import CollectorRegistry, Gauge, push_to_gateway
-
-# 設定日誌
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler('/data/mssp_monitor.log'),
-        logging.StreamHandler()
-    ]
-)
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Tuple
+from dashboard_api import SummaryCache
+from http_pool import ConnectionPool
+from scan_events import ScanEventBus
+from scan_pool import ProcessScanPool, TenantScan, scan_tenant
+from sinks import ScanSnapshot, SinkFanout, build_sinks
+
 logger = logging.getLogger(__name__)
 
 # === 從環境變數讀取配置 ===
@@ -37,138 +42,198 @@ CONFIG = {
 }
 
 INFLUXDB_CONFIG = {
+    "enabled": os.getenv("INFLUXDB_ENABLED", "true").lower() == "true",
     "url": os.getenv("INFLUXDB_URL", "http://influxdb:8086"),
     "token": os.getenv("INFLUXDB_TOKEN"),
     "org": os.getenv("INFLUXDB_ORG", "aishield"),
-    "bucket": os.getenv("INFLUXDB_BUCKET", "crowdstrike")
+    "bucket": os.getenv("INFLUXDB_BUCKET", "crowdstrike"),
+    "fast_path": os.getenv("INFLUXDB_FAST_PATH", "true").lower() == "true",
+    "gzip": os.getenv("INFLUXDB_GZIP", "true").lower() == "true"
 }
 
+PROMETHEUS_ENABLED = os.getenv("PROMETHEUS_ENABLED", "true").lower() == "true"
 PROMETHEUS_PUSHGATEWAY = os.getenv("PROMETHEUS_PUSHGATEWAY", "http://prometheus-pushgateway:9091")
 
+DASHBOARD_API_CONFIG = {
+    "enabled": os.getenv("DASHBOARD_API_ENABLED", "true").lower() == "true",
+    "host": os.getenv("DASHBOARD_API_HOST", "0.0.0.0"),
+    "port": int(os.getenv("DASHBOARD_API_PORT", "8080"))
+}
+
 STATE_FILE = "/data/mssp_inventory.json"
 
+DEDUP_CONFIG = {
+    "sketch_dir": os.getenv("DEDUP_SKETCH_DIR", "/data/sketches")
+}
+
+HTTP_POOL_CONFIG = {
+    "pool_maxsize": int(os.getenv("HTTP_POOL_MAXSIZE", "10")),        # 每個主機保留的連線數
+    "pool_hosts": int(os.getenv("HTTP_POOL_HOSTS", "20")),            # 保留連線池的主機數
+    "connect_timeout": float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+    "read_timeout": float(os.getenv("HTTP_READ_TIMEOUT", "30")),
+    "proxy": os.getenv("HTTPS_PROXY") or os.getenv("https_proxy"),
+    "keepalive": os.getenv("HTTP_KEEPALIVE", "true").lower() == "true"
+}
+
+ALERT_CONFIG = {
+    "enabled": os.getenv("ALERTS_ENABLED", "true").lower() == "true",
+    "rules_file": os.getenv("ALERT_RULES_FILE"),                      # 未設定時使用內建預設規則
+    "state_file": os.getenv("ALERT_STATE_FILE", "/data/alert_state.json"),
+    "channels": [c.strip() for c in os.getenv("ALERT_CHANNELS", "log,alertmanager").split(",") if c.strip()],
+    "log_file": os.getenv("ALERT_LOG_FILE", "/data/alerts.jsonl"),
+    "webhook_url": os.getenv("ALERT_WEBHOOK_URL"),
+    "alertmanager_url": os.getenv("ALERTMANAGER_URL", "http://alertmanager:9093"),
+    "flap_window": int(os.getenv("ALERT_FLAP_WINDOW", "6")),          # 觀察最近幾輪
+    "flap_limit": int(os.getenv("ALERT_FLAP_LIMIT", "4"))             # 期間內切換幾次視為抖動
+}
+
+SCAN_CONFIG = {
+    "processes": int(os.getenv("SCAN_PROCESSES", "1")),               # >1 時租戶處理分散到多個行程
+    "chunk_size": int(os.getenv("SCAN_CHUNK_SIZE", "8")),             # 每次派給 worker 的租戶數
+    "breakdown": os.getenv("SCAN_HOST_BREAKDOWN", "false").lower() == "true"   # 逐筆彙整主機平台
+}
+
+BACKFILL_CONFIG = {
+    "workers": int(os.getenv("BACKFILL_WORKERS", "4")),
+    "checkpoint": os.getenv("BACKFILL_CHECKPOINT", "/data/backfill_checkpoint.json")
+}
+
+
+def _default_sinks() -> str:
+    names = []
+    if INFLUXDB_CONFIG["enabled"]:
+        names.append("influxdb")
+    if PROMETHEUS_ENABLED:
+        names.append("prometheus")
+    names.append("state_file")
+    if ALERT_CONFIG["enabled"]:
+        names.append("alerts")
+    return ",".join(names)
+
+
+SINK_CONFIG = {
+    # 可用: influxdb, prometheus, state_file, csv, parquet, alerts
+    "sinks": [n.strip() for n in os.getenv("SINKS", _default_sinks()).split(",") if n.strip()],
+    "timeout": float(os.getenv("SINK_TIMEOUT", "30")),
+    "queue_size": int(os.getenv("SINK_QUEUE_SIZE", "2")),
+    "snapshot_dir": os.getenv("SNAPSHOT_DIR", "/data/snapshots")
+}
+LOG_FILE = os.getenv("LOG_FILE", "/data/mssp_monitor.log")
+
+
+def setup_logging():
+    """設定日誌（檔案在第一筆記錄寫入時才開啟）"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        handlers=[
+            logging.FileHandler(LOG_FILE, delay=True),
+            logging.StreamHandler()
+        ]
+    )
+
+
+def influxdb_sink_options() -> Dict:
+    return {k: INFLUXDB_CONFIG[k] for k in ["url", "token", "org", "bucket", "fast_path", "gzip"]}
+
+
+def alert_sink_options(http_pool: ConnectionPool = None) -> Dict:
+    return {
+        "threshold": CONFIG["license_threshold"],
+        "pinned_list": [c.lower() for c in CONFIG["pinned_cids"]],
+        "rules_file": ALERT_CONFIG["rules_file"],
+        "state_file": ALERT_CONFIG["state_file"],
+        "channels": ALERT_CONFIG["channels"],
+        "flap_window": ALERT_CONFIG["flap_window"],
+        "flap_limit": ALERT_CONFIG["flap_limit"],
+        "channel_options": {
+            "log_file": ALERT_CONFIG["log_file"],
+            "webhook_url": ALERT_CONFIG["webhook_url"],
+            "alertmanager_url": ALERT_CONFIG["alertmanager_url"],
+            "refresh_seconds": CONFIG["check_interval"],
+            "http_pool": http_pool,
+        },
+    }
+
 
 class MetricsExporter:
-    """統一的指標匯出器"""
+    """統一的指標匯出器：將每輪快照平行分送到所有啟用的 sink"""
     
-    def __init__(self):
-        # InfluxDB 連線
-        self.influx_client = InfluxDBClient(
-            url=INFLUXDB_CONFIG["url"],
-            token=INFLUXDB_CONFIG["token"],
-            org=INFLUXDB_CONFIG["org"]
+    def __init__(self, http_pool: ConnectionPool = None):
+        sink_names = SINK_CONFIG["sinks"]
+        if "alerts" in sink_names:
+            import alerts  # noqa: F401  註冊 alerts sink
+        options = {
+            "influxdb": dict(influxdb_sink_options(), http_pool=http_pool),
+            "prometheus": {"pushgateway": PROMETHEUS_PUSHGATEWAY, "http_pool": http_pool},
+            "state_file": {"path": STATE_FILE},
+            "csv": {"snapshot_dir": SINK_CONFIG["snapshot_dir"]},
+            "parquet": {"snapshot_dir": SINK_CONFIG["snapshot_dir"]},
+            "alerts": alert_sink_options(http_pool),
+        }
+        timeouts = {
+            name: float(os.getenv(f"SINK_TIMEOUT_{name.upper()}", SINK_CONFIG["timeout"]))
+            for name in sink_names
+        }
+        self.fanout = SinkFanout(
+            build_sinks(sink_names, options),
+            timeouts=timeouts,
+            queue_size=SINK_CONFIG["queue_size"]
         )
-        self.influx_write_api = self.influx_client.write_api(write_options=SYNCHRONOUS)
-        
-        # Prometheus Registry
-        self.prom_registry = CollectorRegistry()
-        self.prom_gauges = {}
         
-        logger.info("MetricsExporter 初始化完成")
+        logger.info(f"MetricsExporter 初始化完成  (sinks: {', '.join(sink_names)})")
     
-    def write_to_influxdb(self, cid: str, tenant_name: str, count: int, is_pinned: bool, parent_cid: str):
-        """寫入 InfluxDB"""
-        try:
-            point = (
-                Point("crowdstrike_hosts")
-                .tag("cid", cid)
-                .tag("tenant_name", tenant_name)
-                .tag("is_pinned", str(is_pinned))
-                .tag("parent_cid", parent_cid)
-                .field("host_count", count)
-                .time(datetime.now(timezone.utc), WritePrecision.NS)
-            )
-            
-            self.influx_write_api.write(
-                bucket=INFLUXDB_CONFIG["bucket"],
-                org=INFLUXDB_CONFIG["org"],
-                record=point
-            )
-            logger.debug(f"InfluxDB: 寫入 {tenant_name} ({cid}): {count}")
-        except Exception as e:
-            logger.error(f"InfluxDB 寫入失敗: {e}")
-    
-    def write_pinned_summary_to_influxdb(self, total: int, threshold: int, over_threshold: bool):
-        """寫入 Pinned 總計到 InfluxDB"""
-        try:
-            point = (
-                Point("crowdstrike_pinned_summary")
-                .tag("threshold", str(threshold))
-                .field("total_count", total)
-                .field("over_threshold", int(over_threshold))
-                .time(datetime.now(timezone.utc), WritePrecision.NS)
-            )
-            
-            self.influx_write_api.write(
-                bucket=INFLUXDB_CONFIG["bucket"],
-                org=INFLUXDB_CONFIG["org"],
-                record=point
-            )
-            logger.info(f"InfluxDB: Pinned 總計 {total} (閾值: {threshold})")
-        except Exception as e:
-            logger.error(f"InfluxDB Pinned 總計寫入失敗: {e}")
-    
-    def push_to_prometheus(self, metrics_data: Dict):
-        """推送到 Prometheus Pushgateway"""
-        try:
-            # 為每個租戶建立 Gauge
-            for cid, data in metrics_data.items():
-                # 跳過特殊鍵 _pinned_total
-                if cid == '_pinned_total':
-                    continue
-                    
-                gauge_name = f"crowdstrike_host_count"
-                if gauge_name not in self.prom_gauges:
-                    self.prom_gauges[gauge_name] = Gauge(
-                        gauge_name,
-                        'CrowdStrike active hosts count',
-                        ['cid', 'tenant_name', 'is_pinned'],
-                        registry=self.prom_registry
-                    )
-                
-                self.prom_gauges[gauge_name].labels(
-                    cid=cid,
-                    tenant_name=data['name'],
-                    is_pinned=str(data['is_pinned'])
-                ).set(data['count'])
-            
-            # Pinned 總計
-            pinned_gauge = Gauge(
-                'crowdstrike_pinned_total',
-                'Total pinned CIDs host count',
-                ['threshold'],
-                registry=self.prom_registry
-            )
-            pinned_gauge.labels(
-                threshold=str(CONFIG['license_threshold'])
-            ).set(metrics_data.get('_pinned_total', 0))
-            
-            # 推送到 Pushgateway
-            push_to_gateway(
-                PROMETHEUS_PUSHGATEWAY,
-                job='mssp-monitor',
-                registry=self.prom_registry
-            )
-            logger.info("Prometheus: 指標推送完成")
-        except Exception as e:
-            logger.error(f"Prometheus 推送失敗: {e}")
+    def export(self, snapshot: ScanSnapshot) -> Dict[str, tuple]:
+        """分送快照，回傳各 sink 的 (成功與否, 說明)"""
+        return self.fanout.publish(snapshot)
     
     def close(self):
-        """關閉連線"""
-        self.influx_client.close()
+        """關閉所有 sink"""
+        self.fanout.close()
 
 
 class MSSPMonitor:
     """CrowdStrike MSSP 監控系統"""
     
     def __init__(self):
+        from falconpy import FlightControl, OAuth2
+
+        # 所有 HTTP 客戶端共用同一組連線池設定
+        self.http_pool = ConnectionPool(**HTTP_POOL_CONFIG)
+        self.http_pool.install_falconpy()
+
         self.creds = {k: CONFIG[k] for k in ["client_id", "client_secret", "base_url"]}
+        self.creds.update(self.http_pool.falcon_kwargs())
         self.auth = OAuth2(**self.creds)
         self.fc = FlightControl(**self.creds)
         self.parent_cid = "unknown"
         self.pinned_list = [c.lower() for c in CONFIG.get("pinned_cids", [])]
-        self.exporter = MetricsExporter()
+        self._hosts_clients = {}
+        self.exporter = MetricsExporter(self.http_pool)
+        self.summary_cache = SummaryCache()
+        # 上一輪各租戶端點數：啟動時從狀態檔載入，之後由監控本身保存，
+        # 不依賴 state_file sink 是否啟用或寫入成功
+        self.previous_counts = self._load_previous_counts()
+        if "state_file" not in SINK_CONFIG["sinks"]:
+            logger.warning("未啟用 state_file sink：重啟後第一輪的增減量將以 0 為基準")
+        if self.previous_counts:
+            self.summary_cache.seed(self.previous_counts, self.pinned_list, os.path.getmtime(STATE_FILE))
+        self.scan_events = ScanEventBus()
+        self.dashboard_server = None
+        self.scan_pool = None
+        self.worker_http = (0, 0, 0, 0)   # 本輪 worker 的 (連線數, 請求數, TLS handshake 數, worker 數)
         
+    @staticmethod
+    def _load_previous_counts() -> Dict[str, int]:
+        if not os.path.exists(STATE_FILE):
+            return {}
+        try:
+            with open(STATE_FILE, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"讀取狀態檔失敗，重啟後第一輪的增減量將以 0 為基準: {e}")
+            return {}
+
     def validate_and_setup(self) -> bool:
         """驗證憑證並初始化"""
         try:
@@ -176,6 +241,8 @@ class MSSPMonitor:
                 logger.error("CrowdStrike 認證失敗")
                 return False
             
+            from falconpy import Hosts
+
             temp_hosts = Hosts(**self.creds)
             r = temp_hosts.query_devices_by_filter(limit=1)
             self.parent_cid = r['body']['meta']['pagination'].get('cid', 'unknown').lower()
@@ -217,23 +284,63 @@ class MSSPMonitor:
         logger.info(f"發現 {len(final_map)} 個租戶")
         return final_map
     
-    def fetch_count(self, cid: str) -> int:
-        """查詢指定 CID 的活躍端點數"""
-        try:
+    def _hosts_api(self, cid: str):
+        """每個 CID 沿用同一個 Hosts 實例（token 未過期前不重新認證）"""
+        hosts_api = self._hosts_clients.get(cid)
+        if hosts_api is None:
+            from falconpy import Hosts
+
             is_parent = (cid == self.parent_cid)
             hosts_api = Hosts(**self.creds, member_cid=None if is_parent else cid)
-            resp = hosts_api.query_devices_by_filter_scroll(filter="last_seen:>'now-7d'", limit=1)
-            
-            if resp["status_code"] == 200:
-                return resp["body"]["meta"]["pagination"]["total"]
-            else:
-                logger.warning(f"CID {cid} 查詢失敗: {resp['status_code']}")
-                return 0
-        except Exception as e:
-            logger.error(f"查詢 {cid} 時發生錯誤: {e}")
-            return 0
+            self._hosts_clients[cid] = hosts_api
+        return hosts_api
+
+    def fetch_count(self, cid: str) -> int:
+        """查詢指定 CID 的活躍端點數"""
+        return scan_tenant(self._hosts_api, cid).count
+
+    def _scan_tenants(self, cids: List[str]) -> Iterator[Tuple[str, TenantScan]]:
+        """逐一產生各租戶處理結果；SCAN_PROCESSES > 1 時交給 worker 行程池"""
+        if SCAN_CONFIG["processes"] <= 1:
+            for cid in cids:
+                yield cid, scan_tenant(self._hosts_api, cid, SCAN_CONFIG["breakdown"])
+            return
+
+        # worker 異常結束（OOM、segfault）會讓整個行程池失效：重建後只重跑尚未完成的租戶，
+        # 重建後仍失敗則本輪掃描失敗，下一輪再重建
+        finished = set()
+        for attempt in (1, 2):
+            if self.scan_pool is None:
+                self.scan_pool = ProcessScanPool(
+                    SCAN_CONFIG["processes"],
+                    creds=self.creds,
+                    parent_cid=self.parent_cid,
+                    http_pool_config=HTTP_POOL_CONFIG,
+                    breakdown=SCAN_CONFIG["breakdown"],
+                    chunk_size=SCAN_CONFIG["chunk_size"]
+                )
+                logger.info(f"多行程掃描模式: {SCAN_CONFIG['processes']} 個 worker")
+            try:
+                for cid, result in self.scan_pool.scan([c for c in cids if c not in finished]):
+                    finished.add(cid)
+                    yield cid, result
+                self._collect_worker_http()
+                return
+            except BrokenProcessPool as e:
+                logger.error(f"worker 行程異常結束，重建行程池（第 {attempt} 次）: {e}")
+                self._collect_worker_http()     # 失效前已完成的分段仍計入本輪
+                self.scan_pool.close()
+                self.scan_pool = None
+                if attempt == 2:
+                    raise RuntimeError("worker 行程池重建後仍異常結束，本輪掃描失敗") from e
     
-    def _print_report(self, tenant_map: Dict, new_data: Dict, old_data: Dict, pinned_total_current: int):
+    def _collect_worker_http(self):
+        """把目前行程池本輪的連線統計累加到 worker_http（連線數, 請求數, TLS handshake 數, worker 數）"""
+        stats = self.scan_pool.http_summary() + (self.scan_pool.worker_count,)
+        self.worker_http = tuple(a + b for a, b in zip(self.worker_http, stats))
+
+    def _print_report(self, tenant_map: Dict, new_data: Dict, old_data: Dict, pinned_total_current: int,
+                      failed: set = frozenset()):
         """在 terminal 印出直觀的掃描報告"""
         fetch_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         threshold  = CONFIG['license_threshold']
@@ -247,6 +354,8 @@ class MSSPMonitor:
             old     = old_data.get(cid, 0)
             change  = current - old
             tag     = "📌 PINNED" if cid in self.pinned_list else ""
+            if cid in failed:
+                tag = "⚠️ 查詢失敗"
 
             if change > 0:
                 change_str = f"+{change} ▲"
@@ -324,27 +433,28 @@ class MSSPMonitor:
         logger.info("=" * 80)
         logger.info("開始新一輪掃描")
 
+        http_base = self.http_pool.summary()
+        self.worker_http = (0, 0, 0, 0)
         tenant_map = self.get_tenants_info()
 
-        # 讀取舊狀態
-        if os.path.exists(STATE_FILE):
-            with open(STATE_FILE, "r") as f:
-                old_data = json.load(f)
-        else:
-            old_data = {}
+        old_data = self.previous_counts
 
         new_data               = {}
         metrics_data           = {}
+        failed                 = set()
         pinned_total_current   = 0
 
         # ── 逐一抓取各租戶 ────────────────────────────────────────
         total_tenants = len(tenant_map)
-        for idx, (cid, name) in enumerate(tenant_map.items(), start=1):
+        self.scan_events.scan_started(total_tenants)
+        for idx, (cid, result) in enumerate(self._scan_tenants(list(tenant_map)), start=1):
+            name = tenant_map[cid]
             # 即時進度提示
             print(f"\r  🔍 抓取中... [{idx}/{total_tenants}] {name[:30]:<30}", end="", flush=True)
 
-            current  = self.fetch_count(cid)
             old      = old_data.get(cid, 0)
+            # 查詢失敗的租戶沿用上一輪數量並標記 failed，不當成真的 0 台
+            current  = result.count if result.ok else old
             change   = current - old
             is_pinned = cid in self.pinned_list
 
@@ -353,41 +463,58 @@ class MSSPMonitor:
                 'name': name, 'count': current,
                 'is_pinned': is_pinned, 'change': change
             }
+            if not result.ok:
+                failed.add(cid)
+                metrics_data[cid]['failed'] = True
+            elif result.platforms is not None:
+                metrics_data[cid]['platforms'] = result.platform_counts()
 
-            # 寫入 InfluxDB（每筆即時寫入）
-            self.exporter.write_to_influxdb(
-                cid=cid, tenant_name=name, count=current,
-                is_pinned=is_pinned, parent_cid=self.parent_cid
-            )
+            # 即時推送給本機 API 的串流訂閱者
+            self.scan_events.tenant_result(cid, name, current, old, is_pinned, failed=not result.ok)
 
             if is_pinned:
                 pinned_total_current += current
 
         print()   # 進度列換行
+        self.previous_counts = new_data
 
         # ── 印出完整報告表格 ──────────────────────────────────────
-        self._print_report(tenant_map, new_data, old_data, pinned_total_current)
-
-        # ── Pinned 總計寫入 InfluxDB ──────────────────────────────
-        threshold      = CONFIG['license_threshold']
-        over_threshold = pinned_total_current > threshold
-        metrics_data['_pinned_total'] = pinned_total_current
-
-        self.exporter.write_pinned_summary_to_influxdb(
-            total=pinned_total_current,
-            threshold=threshold,
-            over_threshold=over_threshold
+        self._print_report(tenant_map, new_data, old_data, pinned_total_current, failed)
+        if failed:
+            logger.warning(f"{len(failed)} 個租戶查詢失敗，沿用上一輪數量: {', '.join(sorted(failed))}")
+
+        # ── 快照平行分送到所有 sink ──────────────────────────────
+        threshold = CONFIG['license_threshold']
+        self.scan_events.scan_finished(pinned_total_current, threshold)
+        snapshot  = ScanSnapshot(metrics_data, self.parent_cid, threshold)
+
+        for label, (ok, status) in self.exporter.export(snapshot).items():
+            icon = "✅" if ok else "❌"
+            print(f"  [{label}]{' ' * max(12 - len(label), 1)}{icon} {status}")
+
+        # 連線池計數只增不減：以本輪開始時的值相減，只顯示本輪新開的連線與請求
+        connections, requests, handshakes = (now - base for now, base in zip(self.http_pool.summary(), http_base))
+        logger.info(f"HTTP 連線統計（累計）: {self.http_pool.stats()}")
+        scope = ""
+        if self.worker_http[3]:
+            # 多行程模式下 Falcon 流量都在 worker 的連線池，一併加總
+            w_connections, w_requests, w_handshakes, workers = self.worker_http
+            logger.info(f"worker HTTP 連線統計: {w_requests} 次請求 / {w_connections} 條連線 "
+                        f"({workers} 個 worker)")
+            connections += w_connections
+            requests += w_requests
+            handshakes += w_handshakes
+            scope = f"（含 {workers} 個 worker 行程）"
+        print(f"  [HTTP]        🔌 {requests} 次請求 / {connections} 條連線 / {handshakes} 次 TLS handshake{scope}")
+
+        # ── 預先計算 Dashboard 摘要（取代面板即時聚合） ──────────
+        self.summary_cache.update(
+            tenant_map=tenant_map,
+            new_data=new_data,
+            pinned_list=self.pinned_list,
+            threshold=threshold
         )
-        print(f"  [InfluxDB]    ✅ 寫入完成  ({len(new_data)} 筆)")
-
-        # ── 推送 Prometheus ───────────────────────────────────────
-        self.exporter.push_to_prometheus(metrics_data)
-        print(f"  [Prometheus]  ✅ 推送完成")
-
-        # ── 儲存本機狀態 ──────────────────────────────────────────
-        with open(STATE_FILE, "w") as f:
-            json.dump(new_data, f, indent=4)
-        print(f"  [State File]  ✅ 已儲存至 {STATE_FILE}")
+        print(f"  [Dashboard]   ✅ 摘要已更新  (v{self.summary_cache.version})")
 
         next_time = datetime.fromtimestamp(
             time.time() + CONFIG['check_interval']
@@ -396,8 +523,8 @@ class MSSPMonitor:
 
         logger.info("掃描完成")
     
-    def start(self):
-        """啟動監控循環"""
+    def _startup(self, once: bool = False):
+        """印出啟動資訊並驗證憑證"""
         print()
         print("╔══════════════════════════════════════════╗")
         print("║  CrowdStrike MSSP Monitor  v2.0          ║")
@@ -413,10 +540,131 @@ class MSSPMonitor:
         if self.pinned_list:
             for cid in self.pinned_list:
                 print(f"        - {cid}")
-        print(f"  ⚙️  檢查間隔: {CONFIG['check_interval']} 秒")
+        if not once:
+            print(f"  ⚙️  檢查間隔: {CONFIG['check_interval']} 秒")
         print(f"  ⚠️  授權閾值: {CONFIG['license_threshold']} 台")
+        if DASHBOARD_API_CONFIG["enabled"] and not once:
+            from dashboard_api import start_dashboard_api
+
+            self.dashboard_server = start_dashboard_api(
+                self.summary_cache,
+                DASHBOARD_API_CONFIG["host"],
+                DASHBOARD_API_CONFIG["port"],
+                events=self.scan_events
+            )
+            print(f"  📡 Dashboard API: port {DASHBOARD_API_CONFIG['port']}")
         print()
 
+    def close(self):
+        """關閉 sink、worker 行程與連線池"""
+        self.exporter.close()
+        if self.scan_pool is not None:
+            self.scan_pool.close()
+        self.http_pool.close()
+
+    def run_once(self) -> int:
+        """單次掃描（供 cron / Kubernetes Job 使用），回傳 exit code"""
+        self._startup(once=True)
+        try:
+            self.run_iteration()
+            return 0
+        except Exception as e:
+            logger.error(f"執行時發生錯誤: {e}", exc_info=True)
+            print(f"\n  ❌ 發生錯誤: {e}")
+            return 1
+        finally:
+            self.close()
+
+    def run_backfill(self, start: date, end: date, workers: int) -> int:
+        """回補歷史每日資料到 InfluxDB，回傳 exit code"""
+        from backfill import Backfiller
+        from sinks import InfluxDBSink
+
+        self._startup(once=True)
+        sink = InfluxDBSink(**influxdb_sink_options(), http_pool=self.http_pool)
+        try:
+            backfiller = Backfiller(
+                creds=self.creds,
+                parent_cid=self.parent_cid,
+                tenant_map=self.get_tenants_info(),
+                pinned_list=self.pinned_list,
+                threshold=CONFIG['license_threshold'],
+                sink=sink,
+                checkpoint_path=BACKFILL_CONFIG["checkpoint"],
+                workers=workers
+            )
+            _, failed = backfiller.run(start, end)
+            return 1 if failed else 0
+        except Exception as e:
+            logger.error(f"回補時發生錯誤: {e}", exc_info=True)
+            print(f"\n  ❌ 發生錯誤: {e}")
+            return 1
+        finally:
+            sink.close()
+            self.close()
+
+    def run_dedup(self, days: int, workers: int) -> int:
+        """建立 Pinned CIDs 主機 sketch 並印出去重報告，回傳 exit code"""
+        from dedup import DedupScanner, SketchStore, overlap_report
+
+        self._startup(once=True)
+        try:
+            tenant_map = self.get_tenants_info()
+            cids = [cid for cid in self.pinned_list if cid in tenant_map]
+            if not cids:
+                print("  [!] 沒有可用的 Pinned CID")
+                return 1
+
+            print(f"  🔍 建立 {len(cids)} 個 Pinned 租戶的主機 sketch...")
+            scanned = DedupScanner(self.creds, self.parent_cid, workers=workers).scan(cids)
+            api_counts = {cid: seen for cid, (_, seen) in scanned.items()}
+
+            store = SketchStore(DEDUP_CONFIG["sketch_dir"])
+            today = datetime.now(timezone.utc).date()
+            store.save(today, {cid: sketch for cid, (sketch, _) in scanned.items()})
+            if days > 1:
+                sketches = store.load_window(cids, today - timedelta(days=days - 1), today)
+            else:
+                sketches = {cid: sketch for cid, (sketch, _) in scanned.items()}
+
+            self._print_dedup_report(tenant_map, api_counts, overlap_report(sketches), days)
+            return 0
+        except Exception as e:
+            logger.error(f"去重時發生錯誤: {e}", exc_info=True)
+            print(f"\n  ❌ 發生錯誤: {e}")
+            return 1
+        finally:
+            self.close()
+
+    def _print_dedup_report(self, tenant_map: Dict, api_counts: Dict, report: Dict, days: int):
+        """印出去重報告"""
+        threshold = CONFIG['license_threshold']
+        mode = "精確" if report["exact"] else "HyperLogLog 估計"
+        print()
+        print("=" * 80)
+        print(f"  📌 Pinned CIDs 跨租戶去重報告（{days} 天視窗，{mode}）")
+        print("=" * 80)
+        for cid, size in sorted(report["sizes"].items(), key=lambda x: -x[1]):
+            print(f"  {tenant_map.get(cid, cid)[:32]:<32} {cid}  API {api_counts.get(cid, 0):>6}  唯一 {size:>6}")
+        print("-" * 80)
+        print(f"  各租戶加總        : {report['raw_total']}")
+        print(f"  實際唯一主機      : {report['unique_total']}  (重複 {report['duplicates']})")
+        over = report["unique_total"] > threshold
+        print(f"  授權閾值          : {threshold}  {'❌ 超過閾值！' if over else '✅ 正常'}")
+        if report["overlaps"]:
+            print("  租戶間重疊：")
+            for a, b, shared, error in report["overlaps"]:
+                value = f"約 {shared} (±{error})" if error else str(shared)
+                print(f"    {tenant_map.get(a, a)[:28]} ↔ {tenant_map.get(b, b)[:28]} : {value}")
+        if report["suppressed_overlaps"]:
+            print(f"  另有 {report['suppressed_overlaps']} 組重疊估計值在 HyperLogLog 誤差範圍內，視為無重疊未列出")
+        print("=" * 80)
+        print()
+
+    def start(self):
+        """啟動監控循環"""
+        self._startup()
+
         while True:
             try:
                 self.run_iteration()
@@ -424,15 +672,61 @@ class MSSPMonitor:
             except KeyboardInterrupt:
                 print("\n  🛑 收到中斷信號，正在關閉...\n")
                 logger.info("收到中斷信號，正在關閉...")
-                self.exporter.close()
+                if self.dashboard_server:
+                    self.dashboard_server.shutdown()
+                self.close()
                 break
             except Exception as e:
                 logger.error(f"執行時發生錯誤: {e}", exc_info=True)
+                self.scan_events.scan_failed(str(e))
                 print(f"\n  ❌ 發生錯誤: {e}")
                 print(f"  ⏳ 60 秒後重試...\n")
                 time.sleep(60)
 
 
-if __name__ == "__main__":
+def _iso_date(value: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日期格式應為 YYYY-MM-DD: {value}")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="CrowdStrike MSSP Monitor")
+    parser.add_argument("--once", action="store_true",
+                        help="只執行一次掃描後結束（適用 cron / Kubernetes Job）")
+    parser.add_argument("--backfill-from", metavar="YYYY-MM-DD", type=_iso_date,
+                        help="回補起始日（UTC），指定後進入回補模式")
+    parser.add_argument("--backfill-to", metavar="YYYY-MM-DD", type=_iso_date,
+                        help="回補結束日（UTC，含當日），預設為昨天")
+    parser.add_argument("--dedup", action="store_true",
+                        help="建立 Pinned CIDs 主機 sketch 並印出跨租戶去重報告")
+    parser.add_argument("--dedup-days", type=int, default=1,
+                        help="去重報告的時間視窗（天），以已儲存的 sketch 做聯集")
+    parser.add_argument("--workers", type=int, default=BACKFILL_CONFIG["workers"],
+                        help="回補 / 去重時平行處理的租戶數")
+    args = parser.parse_args(argv)
+
+    if args.backfill_from:
+        yesterday = datetime.now(timezone.utc).date() - timedelta(days=1)
+        backfill_end = args.backfill_to or yesterday
+        # 當日尚未結束：23:59:59 的時間點會落在未來，數值也只是目前的 last_seen
+        if backfill_end > yesterday:
+            parser.error(f"--backfill-to {backfill_end} 必須早於今天（UTC），最晚為 {yesterday}")
+        if args.backfill_from > backfill_end:
+            parser.error(f"--backfill-from {args.backfill_from} 晚於回補結束日 {backfill_end}")
+
+    setup_logging()
     monitor = MSSPMonitor()
+    if args.backfill_from:
+        return monitor.run_backfill(args.backfill_from, backfill_end, args.workers)
+    if args.dedup:
+        return monitor.run_dedup(max(args.dedup_days, 1), args.workers)
+    if args.once:
+        return monitor.run_once()
     monitor.start()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
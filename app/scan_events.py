@@ -0,0 +1,134 @@
+"""
+掃描事件匯流排
+run_iteration 每抓完一個租戶就發布事件，本機 API 以 SSE / JSON lines 即時串流給訂閱者，
+並保留目前掃描狀態與上一輪完整快照。慢速訂閱者的佇列滿了只會丟棄它自己的事件。
+"""
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+REPLAY_SIZE = 1000          # 保留最近的事件，供 Last-Event-ID 斷線續傳
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+class Subscription:
+    def __init__(self, bus: "ScanEventBus", maxsize: int):
+        self.bus = bus
+        self.queue: "queue.Queue[Dict]" = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def get(self, timeout: float) -> Optional[Dict]:
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class ScanEventBus:
+    """發布 / 訂閱掃描事件，並維護掃描狀態"""
+
+    def __init__(self, replay_size: int = REPLAY_SIZE):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._subscribers: List[Subscription] = []
+        self._recent = deque(maxlen=replay_size)
+        self._status: Dict = {"state": "idle", "scan_id": 0}
+        self._scan_ids = itertools.count(1)
+        self._last_snapshot: Dict = {}
+        self._partial: Dict[str, Dict] = {}
+
+    # ── 訂閱 ──────────────────────────────────────────────────
+    def subscribe(self, last_event_id: Optional[int] = None,
+                  maxsize: int = SUBSCRIBER_QUEUE_SIZE) -> Subscription:
+        sub = Subscription(self, maxsize)
+        with self._lock:
+            if last_event_id is not None:
+                for event in self._recent:
+                    if event["id"] > last_event_id:
+                        sub.queue.put_nowait(event)
+            self._subscribers.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+
+    def publish(self, event_type: str, data: Dict) -> Dict:
+        with self._lock:
+            event = {"id": next(self._ids), "event": event_type, "time": time.time(), "data": data}
+            self._recent.append(event)
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            try:
+                sub.queue.put_nowait(event)
+            except queue.Full:
+                sub.dropped += 1
+        return event
+
+    # ── 掃描生命週期 ──────────────────────────────────────────
+    def scan_started(self, total: int):
+        with self._lock:
+            scan_id = next(self._scan_ids)
+            self._partial = {}
+            self._status = {
+                "state": "running", "scan_id": scan_id, "started_at": time.time(),
+                "done": 0, "total": total, "pinned_total": 0,
+            }
+        self.publish("scan_start", {"scan_id": scan_id, "total": total})
+
+    def tenant_result(self, cid: str, name: str, count: int, old: int, is_pinned: bool,
+                      failed: bool = False):
+        """failed 表示本輪查詢失敗，count 為沿用的上一輪數量"""
+        with self._lock:
+            self._partial[cid] = {"name": name, "count": count, "old": old, "is_pinned": is_pinned,
+                                  "failed": failed}
+            self._status["done"] += 1
+            if is_pinned:
+                self._status["pinned_total"] += count
+            progress = {k: self._status[k] for k in ("scan_id", "done", "total")}
+        data = dict(progress, cid=cid, name=name, count=count, change=count - old,
+                    is_pinned=is_pinned, failed=failed)
+        self.publish("tenant", data)
+        if is_pinned and count != old:
+            self.publish("pinned_change", data)
+
+    def scan_finished(self, pinned_total: int, threshold: int):
+        with self._lock:
+            status = dict(self._status, state="idle", finished_at=time.time(),
+                          pinned_total=pinned_total, threshold=threshold,
+                          over_threshold=pinned_total > threshold)
+            self._status = status
+            self._last_snapshot = {
+                "scan_id": status["scan_id"],
+                "finished_at": status["finished_at"],
+                "pinned_total": pinned_total,
+                "threshold": threshold,
+                "tenants": self._partial,
+            }
+        self.publish("scan_end", {k: status[k] for k in
+                                  ("scan_id", "pinned_total", "threshold", "over_threshold")})
+
+    def scan_failed(self, error: str):
+        with self._lock:
+            self._status = dict(self._status, state="failed", error=error)
+            scan_id = self._status["scan_id"]
+        self.publish("scan_error", {"scan_id": scan_id, "error": error})
+
+    def status(self) -> Dict:
+        with self._lock:
+            return dict(self._status)
+
+    def partial_results(self) -> Dict:
+        with self._lock:
+            return dict(self._partial)
+
+    def last_snapshot(self) -> Dict:
+        with self._lock:
+            return self._last_snapshot
@@ -0,0 +1,158 @@
+"""
+多行程掃描模式
+租戶層級的處理（查詢端點數、主機明細彙整）分散到多個 worker 行程，
+避免主行程受 GIL 限制只用到一顆 CPU。每個 worker 有自己的連線池與
+Hosts 實例快取，結果以固定長度的二進位紀錄回傳，主行程解碼後交給單一 exporter；
+各 worker 的累計連線統計隨結果一併回傳，主行程扣除本次 scan() 開始時的值後加總。
+
+worker 一律以 spawn 啟動：主行程已有 sink / Dashboard API 執行緒，fork 不安全。
+"""
+import logging
+import multiprocessing
+import os
+import struct
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from host_inventory import iter_host_details
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_FILTER = "last_seen:>'now-7d'"
+
+# 主機明細彙整的平台分類（順序即紀錄欄位順序）
+PLATFORMS = ("Windows", "Mac", "Linux", "Other")
+
+# 每個租戶一筆：成功旗標、端點數、各平台端點數；順序與送出的 CID 清單一致，不重複傳 CID
+RECORD = struct.Struct("<BI" + "I" * len(PLATFORMS))
+
+
+class TenantScan:
+    """單一租戶的處理結果"""
+
+    __slots__ = ("ok", "count", "platforms")
+
+    def __init__(self, ok: bool, count: int, platforms: Optional[Tuple[int, ...]] = None):
+        self.ok = ok
+        self.count = count
+        self.platforms = platforms
+
+    def platform_counts(self) -> Optional[Dict[str, int]]:
+        if self.platforms is None:
+            return None
+        return dict(zip(PLATFORMS, self.platforms))
+
+
+def scan_tenant(get_hosts_api: Callable, cid: str, breakdown: bool = False) -> TenantScan:
+    """
+    查詢租戶活躍端點數；breakdown 時逐筆讀取主機明細並依平台彙整。
+    Hosts 實例的建立也在例外處理範圍內，單一租戶失敗只回傳 ok=False。
+    """
+    try:
+        hosts_api = get_hosts_api(cid)
+        if not breakdown:
+            resp = hosts_api.query_devices_by_filter_scroll(filter=ACTIVE_FILTER, limit=1)
+            if resp["status_code"] != 200:
+                logger.warning(f"CID {cid} 查詢失敗: {resp['status_code']}")
+                return TenantScan(False, 0)
+            return TenantScan(True, resp["body"]["meta"]["pagination"]["total"])
+
+        counts = dict.fromkeys(PLATFORMS, 0)
+        for host in iter_host_details(hosts_api, ACTIVE_FILTER):
+            platform = host.get("platform_name")
+            counts[platform if platform in counts else "Other"] += 1
+        platforms = tuple(counts[p] for p in PLATFORMS)
+        return TenantScan(True, sum(platforms), platforms)
+    except Exception as e:
+        logger.error(f"查詢 {cid} 時發生錯誤: {e}")
+        return TenantScan(False, 0)
+
+
+def encode_results(results: List[TenantScan]) -> bytes:
+    empty = (0,) * len(PLATFORMS)
+    return b"".join(RECORD.pack(int(r.ok), r.count, *(r.platforms or empty)) for r in results)
+
+
+def decode_results(data: bytes, breakdown: bool) -> List[TenantScan]:
+    return [TenantScan(bool(ok), count, tuple(platforms) if breakdown else None)
+            for ok, count, *platforms in RECORD.iter_unpack(data)]
+
+
+# ── worker 行程 ───────────────────────────────────────────────
+_worker: Dict = {}
+
+
+def _init_worker(creds: Dict, parent_cid: str, http_pool_config: Dict, breakdown: bool):
+    from http_pool import ConnectionPool
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    pool = ConnectionPool(**http_pool_config)
+    pool.install_falconpy()
+    _worker.update(creds=creds, parent_cid=parent_cid, breakdown=breakdown, clients={}, http_pool=pool)
+
+
+def _worker_hosts_api(cid: str):
+    clients = _worker["clients"]
+    hosts_api = clients.get(cid)
+    if hosts_api is None:
+        from falconpy import Hosts
+
+        is_parent = (cid == _worker["parent_cid"])
+        hosts_api = Hosts(**_worker["creds"], member_cid=None if is_parent else cid)
+        clients[cid] = hosts_api
+    return hosts_api
+
+
+def _scan_chunk(cids: List[str]) -> Tuple[int, Tuple[int, int, int], bytes]:
+    """回傳 (pid, 該 worker 累計連線統計, 編碼後的結果)"""
+    data = encode_results([scan_tenant(_worker_hosts_api, cid, _worker["breakdown"]) for cid in cids])
+    return os.getpid(), _worker["http_pool"].summary(), data
+
+
+class ProcessScanPool:
+    """常駐的 worker 行程池，跨輪沿用（各行程的 Hosts 實例與連線都保留）"""
+
+    def __init__(self, processes: int, creds: Dict, parent_cid: str, http_pool_config: Dict,
+                 breakdown: bool = False, chunk_size: int = 8):
+        self.processes = processes
+        self.breakdown = breakdown
+        self.chunk_size = max(chunk_size, 1)
+        self._http_stats: Dict[int, Tuple[int, int, int]] = {}   # pid -> 累計 (連線數, 請求數, TLS handshake 數)
+        self._http_baseline: Dict[int, Tuple[int, int, int]] = {}  # pid -> 本次 scan() 開始時的累計值
+        self._scan_pids = set()
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(creds, parent_cid, http_pool_config, breakdown),
+        )
+
+    def scan(self, cids: List[str]) -> Iterator[Tuple[str, TenantScan]]:
+        """依完成順序逐一產生 (cid, 結果)，讓進度事件照常即時發布"""
+        self._http_baseline = dict(self._http_stats)
+        self._scan_pids = set()
+        chunks = [cids[i:i + self.chunk_size] for i in range(0, len(cids), self.chunk_size)]
+        pending = {self.executor.submit(_scan_chunk, chunk): chunk for chunk in chunks}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk = pending.pop(future)
+                pid, http_stats, data = future.result()
+                self._http_stats[pid] = http_stats
+                self._scan_pids.add(pid)
+                yield from zip(chunk, decode_results(data, self.breakdown))
+
+    def http_summary(self) -> Tuple[int, int, int]:
+        """最近一次 scan() 期間所有 worker 的 (連線數, 請求數, TLS handshake 數)"""
+        empty = (0, 0, 0)
+        return tuple(sum(self._http_stats[pid][i] - self._http_baseline.get(pid, empty)[i]
+                         for pid in self._scan_pids)
+                     for i in range(3))
+
+    @property
+    def worker_count(self) -> int:
+        """最近一次 scan() 有回報結果的 worker 數"""
+        return len(self._scan_pids)
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
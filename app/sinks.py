@@ -0,0 +1,371 @@
+"""
+指標輸出 Sink
+每輪掃描的快照同時分送到所有已註冊的 sink（InfluxDB、Prometheus、
+狀態檔、CSV / Parquet 快照…），每個 sink 有自己的執行緒、佇列與逾時，
+單一 sink 失敗或卡住不影響其他 sink。
+"""
+import csv
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from line_protocol import HostLineSerializer, pinned_summary_line, to_ns
+
+logger = logging.getLogger(__name__)
+
+# 名稱 -> Sink 類別
+SINK_REGISTRY: Dict[str, type] = {}
+
+
+def register_sink(name: str) -> Callable[[type], type]:
+    """以名稱註冊 sink 類別，供 SINKS 環境變數選用"""
+    def decorator(cls):
+        cls.name = name
+        SINK_REGISTRY[name] = cls
+        return cls
+    return decorator
+
+
+class ScanSnapshot:
+    """一輪掃描的完整結果（sink 只讀不寫）"""
+
+    def __init__(self, tenants: Dict[str, Dict], parent_cid: str, threshold: int,
+                 scanned_at: Optional[datetime] = None):
+        # tenants: cid -> {'name', 'count', 'is_pinned', 'change'[, 'platforms', 'failed']}
+        # failed: 本輪查詢失敗，count 為沿用的上一輪數量
+        self.tenants = tenants
+        self.parent_cid = parent_cid
+        self.threshold = threshold
+        self.scanned_at = scanned_at or datetime.now(timezone.utc)
+        self.pinned_total = sum(t['count'] for t in tenants.values() if t['is_pinned'])
+        self.over_threshold = self.pinned_total > threshold
+
+    @property
+    def counts(self) -> Dict[str, int]:
+        return {cid: t['count'] for cid, t in self.tenants.items()}
+
+    def measured(self):
+        """本輪實際查詢成功的 (cid, 租戶資料)；時序資料不寫入沿用值"""
+        return ((cid, t) for cid, t in self.tenants.items() if not t.get('failed'))
+
+
+class MetricsSink:
+    """Sink 介面：子類別實作 write()，必要時覆寫 close()"""
+
+    name = "sink"
+    label = "Sink"
+
+    def write(self, snapshot: ScanSnapshot) -> str:
+        """寫出快照，回傳簡短結果說明；失敗時直接拋出例外"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# ═══════════════════════════════════════════════════════════
+#  內建 Sink
+# ═══════════════════════════════════════════════════════════
+@register_sink("influxdb")
+class InfluxDBSink(MetricsSink):
+    """InfluxDB v2（預設走 line protocol 快速路徑）"""
+
+    label = "InfluxDB"
+
+    def __init__(self, url: str, token: str, org: str, bucket: str,
+                 fast_path: bool = True, gzip: bool = True, http_pool=None, **_):
+        from influxdb_client import InfluxDBClient
+        from influxdb_client.client.write_api import SYNCHRONOUS
+
+        self.org = org
+        self.bucket = bucket
+        self.fast_path = fast_path
+        client_options = http_pool.influx_kwargs() if http_pool else {}
+        self.client = InfluxDBClient(url=url, token=token, org=org, enable_gzip=gzip, **client_options)
+        if http_pool:
+            http_pool.register("influxdb", self.client.api_client.rest_client.pool_manager)
+        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        self.serializer = HostLineSerializer()
+
+    def write(self, snapshot: ScanSnapshot) -> str:
+        from influxdb_client import WritePrecision
+
+        if self.fast_path:
+            record = self._line_protocol(snapshot)
+        else:
+            record = self._points(snapshot)
+        self.write_api.write(bucket=self.bucket, org=self.org, record=record,
+                             write_precision=WritePrecision.NS)
+        logger.info(f"InfluxDB: Pinned 總計 {snapshot.pinned_total} (閾值: {snapshot.threshold})")
+        return f"寫入完成  ({len(snapshot.tenants)} 筆)"
+
+    def _line_protocol(self, snapshot: ScanSnapshot) -> bytes:
+        ts_ns = to_ns(snapshot.scanned_at)
+        rows = ((cid, t['name'], t['count'], t['is_pinned']) for cid, t in snapshot.measured())
+        payload = self.serializer.serialize(rows, snapshot.parent_cid, ts_ns)
+        summary = pinned_summary_line(snapshot.pinned_total, snapshot.threshold,
+                                      snapshot.over_threshold, ts_ns=ts_ns)
+        return payload + b"\n" + summary.encode("utf-8")
+
+    def _points(self, snapshot: ScanSnapshot) -> List:
+        from influxdb_client import Point, WritePrecision
+
+        points = [
+            Point("crowdstrike_hosts")
+            .tag("cid", cid)
+            .tag("tenant_name", t['name'])
+            .tag("is_pinned", str(t['is_pinned']))
+            .tag("parent_cid", snapshot.parent_cid)
+            .field("host_count", t['count'])
+            .time(snapshot.scanned_at, WritePrecision.NS)
+            for cid, t in snapshot.measured()
+        ]
+        points.append(
+            Point("crowdstrike_pinned_summary")
+            .tag("threshold", str(snapshot.threshold))
+            .field("total_count", snapshot.pinned_total)
+            .field("over_threshold", int(snapshot.over_threshold))
+            .time(snapshot.scanned_at, WritePrecision.NS)
+        )
+        return points
+
+    def close(self):
+        self.client.close()
+
+
+@register_sink("prometheus")
+class PrometheusSink(MetricsSink):
+    """Prometheus Pushgateway"""
+
+    label = "Prometheus"
+
+    def __init__(self, pushgateway: str, job: str = "mssp-monitor", http_pool=None, **_):
+        from prometheus_client import CollectorRegistry, Gauge
+        from prometheus_client.exposition import default_handler
+
+        self.pushgateway = pushgateway
+        self.job = job
+        self.handler = http_pool.prometheus_handler() if http_pool else default_handler
+        self.registry = CollectorRegistry()
+        self.host_gauge = Gauge(
+            'crowdstrike_host_count',
+            'CrowdStrike active hosts count',
+            ['cid', 'tenant_name', 'is_pinned'],
+            registry=self.registry
+        )
+        self.pinned_gauge = Gauge(
+            'crowdstrike_pinned_total',
+            'Total pinned CIDs host count',
+            ['threshold'],
+            registry=self.registry
+        )
+
+    def write(self, snapshot: ScanSnapshot) -> str:
+        from prometheus_client import push_to_gateway
+
+        for cid, t in snapshot.measured():
+            self.host_gauge.labels(
+                cid=cid,
+                tenant_name=t['name'],
+                is_pinned=str(t['is_pinned'])
+            ).set(t['count'])
+        self.pinned_gauge.labels(threshold=str(snapshot.threshold)).set(snapshot.pinned_total)
+
+        push_to_gateway(self.pushgateway, job=self.job, registry=self.registry, handler=self.handler)
+        logger.info("Prometheus: 指標推送完成")
+        return "推送完成"
+
+
+@register_sink("state_file")
+class StateFileSink(MetricsSink):
+    """本機狀態檔（下一輪計算增減用）"""
+
+    label = "State File"
+
+    def __init__(self, path: str, **_):
+        self.path = path
+
+    def write(self, snapshot: ScanSnapshot) -> str:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot.counts, f, indent=4)
+        os.replace(tmp_path, self.path)
+        return f"已儲存至 {self.path}"
+
+
+# failed = True 表示本輪查詢失敗，host_count 為上一輪沿用值，計費流程應視為過期資料
+SNAPSHOT_COLUMNS = ["scanned_at", "cid", "tenant_name", "is_pinned", "parent_cid", "host_count", "change",
+                    "failed"]
+
+
+def _snapshot_rows(snapshot: ScanSnapshot):
+    scanned_at = snapshot.scanned_at.strftime("%Y-%m-%dT%H:%M:%SZ")
+    for cid, t in snapshot.tenants.items():
+        yield [scanned_at, cid, t['name'], t['is_pinned'], snapshot.parent_cid, t['count'], t.get('change', 0),
+               bool(t.get('failed'))]
+
+
+def _snapshot_path(directory: str, snapshot: ScanSnapshot, ext: str) -> str:
+    stamp = snapshot.scanned_at.strftime("%Y%m%dT%H%M%SZ")
+    return os.path.join(directory, f"crowdstrike_hosts_{stamp}.{ext}")
+
+
+@register_sink("csv")
+class CSVSnapshotSink(MetricsSink):
+    """每輪輸出一個 CSV 快照檔（供計費流程批次匯入）"""
+
+    label = "CSV"
+
+    def __init__(self, snapshot_dir: str, **_):
+        self.directory = snapshot_dir
+        os.makedirs(self.directory, exist_ok=True)
+
+    def write(self, snapshot: ScanSnapshot) -> str:
+        path = _snapshot_path(self.directory, snapshot, "csv")
+        with open(f"{path}.tmp", "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(SNAPSHOT_COLUMNS)
+            writer.writerows(_snapshot_rows(snapshot))
+        os.replace(f"{path}.tmp", path)
+        return f"已輸出 {os.path.basename(path)}"
+
+
+@register_sink("parquet")
+class ParquetSnapshotSink(MetricsSink):
+    """每輪輸出一個 Parquet 快照檔（需安裝 pyarrow）"""
+
+    label = "Parquet"
+
+    def __init__(self, snapshot_dir: str, **_):
+        import pyarrow  # noqa: F401  缺少時於建立 sink 時就失敗
+
+        self.directory = snapshot_dir
+        os.makedirs(self.directory, exist_ok=True)
+
+    def write(self, snapshot: ScanSnapshot) -> str:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = list(zip(*_snapshot_rows(snapshot))) or [[] for _ in SNAPSHOT_COLUMNS]
+        table = pa.table({name: list(col) for name, col in zip(SNAPSHOT_COLUMNS, columns)})
+        path = _snapshot_path(self.directory, snapshot, "parquet")
+        pq.write_table(table, f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+        return f"已輸出 {os.path.basename(path)}"
+
+
+# ═══════════════════════════════════════════════════════════
+#  平行分送
+# ═══════════════════════════════════════════════════════════
+class _Job:
+    def __init__(self, snapshot: ScanSnapshot):
+        self.snapshot = snapshot
+        self.done = threading.Event()
+        self.status = "pending"
+        self.ok = False
+
+
+class SinkWorker:
+    """單一 sink 的背景執行緒與有界佇列"""
+
+    def __init__(self, sink: MetricsSink, timeout: float, queue_size: int):
+        self.sink = sink
+        self.timeout = timeout
+        self.queue: "queue.Queue[Optional[_Job]]" = queue.Queue(maxsize=max(queue_size, 1))
+        self.thread = threading.Thread(target=self._run, name=f"sink-{sink.name}", daemon=True)
+        self.thread.start()
+
+    def submit(self, snapshot: ScanSnapshot) -> _Job:
+        """佇列已滿時丟棄最舊的待處理快照（背壓：只保留最新結果）"""
+        job = _Job(snapshot)
+        while True:
+            try:
+                self.queue.put_nowait(job)
+                return job
+            except queue.Full:
+                try:
+                    dropped = self.queue.get_nowait()
+                except queue.Empty:
+                    continue
+                if dropped is not None:
+                    dropped.status = "已丟棄（佇列已滿）"
+                    dropped.done.set()
+                logger.warning(f"Sink {self.sink.name}: 佇列已滿，丟棄較舊的快照")
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            start = time.perf_counter()
+            try:
+                job.status = self.sink.write(job.snapshot)
+                job.ok = True
+            except Exception as e:
+                job.status = f"失敗: {e}"
+                logger.error(f"Sink {self.sink.name} 寫入失敗: {e}")
+            logger.debug(f"Sink {self.sink.name}: {(time.perf_counter() - start) * 1000:.1f} ms")
+            job.done.set()
+
+    def close(self):
+        try:
+            self.queue.put(None, timeout=self.timeout)
+        except queue.Full:
+            pass
+        self.thread.join(timeout=self.timeout)
+        if self.thread.is_alive():
+            # 仍卡在 write()：不在請求進行中關閉客戶端，交由 daemon 執行緒隨行程結束
+            logger.warning(f"Sink {self.sink.name} 仍在寫入，略過關閉")
+            return
+        try:
+            self.sink.close()
+        except Exception as e:
+            logger.error(f"Sink {self.sink.name} 關閉失敗: {e}")
+
+
+class SinkFanout:
+    """把每份快照同時分送給所有 sink"""
+
+    def __init__(self, sinks: List[MetricsSink], timeouts: Dict[str, float], queue_size: int = 2):
+        self.workers = [SinkWorker(s, timeouts.get(s.name, 30.0), queue_size) for s in sinks]
+
+    def publish(self, snapshot: ScanSnapshot) -> Dict[str, tuple]:
+        """
+        分送快照並等待各 sink 完成（各自逾時）。
+        回傳 {label: (ok, 說明)}；逾時的 sink 會在背景繼續執行。
+        """
+        start = time.monotonic()
+        jobs = [(w, w.submit(snapshot)) for w in self.workers]
+        results = {}
+        for worker, job in jobs:
+            remaining = start + worker.timeout - time.monotonic()
+            if not job.done.wait(timeout=max(remaining, 0)):
+                results[worker.sink.label] = (False, f"逾時（>{worker.timeout:g}s），背景繼續處理")
+                logger.warning(f"Sink {worker.sink.name} 逾時")
+            else:
+                results[worker.sink.label] = (job.ok, job.status)
+        return results
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+
+def build_sinks(names: List[str], options: Dict[str, Dict]) -> List[MetricsSink]:
+    """依名稱建立 sink；無法建立的 sink 記錄錯誤後略過"""
+    sinks = []
+    for name in names:
+        cls = SINK_REGISTRY.get(name)
+        if cls is None:
+            logger.error(f"未知的 sink: {name}（可用: {', '.join(sorted(SINK_REGISTRY))}）")
+            continue
+        try:
+            sinks.append(cls(**options.get(name, {})))
+        except Exception as e:
+            logger.error(f"Sink {name} 初始化失敗: {e}")
+    return sinks
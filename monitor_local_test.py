@@ -15,6 +15,7 @@ CrowdStrike MSSP Monitor - 本機測試版
   - test_history.log（歷史紀錄）
 """
 
+import importlib.util
 import json
 import os
 import sys
@@ -35,12 +36,9 @@ except ImportError:
     print("[!] python-dotenv 未安裝，將直接讀取系統環境變數")
     print("    可執行：pip install python-dotenv")
 
-# ── 嘗試載入 FalconPy ─────────────────────────────────────
-try:
-    from falconpy import Hosts, FlightControl, OAuth2
-    FALCONPY_AVAILABLE = True
-except ImportError:
-    FALCONPY_AVAILABLE = False
+# ── 檢查 FalconPy（只確認是否安裝，實際用到時才 import）────
+FALCONPY_AVAILABLE = importlib.util.find_spec("falconpy") is not None
+if not FALCONPY_AVAILABLE:
     print("[!] crowdstrike-falconpy 未安裝")
     print("    可執行：pip install crowdstrike-falconpy")
 
@@ -67,7 +65,7 @@ logging.basicConfig(
     level=logging.WARNING,          # 只顯示 WARNING 以上，讓 terminal 更乾淨
     format="%(asctime)s [%(levelname)s] %(message)s",
     handlers=[
-        logging.FileHandler(LOG_FILE, encoding="utf-8"),
+        logging.FileHandler(LOG_FILE, encoding="utf-8", delay=True),
     ]
 )
 logger = logging.getLogger(__name__)
@@ -140,6 +138,8 @@ class LocalTester:
         print("└─────────────────────────────────────────┘")
 
         try:
+            from falconpy import Hosts, OAuth2
+
             auth = OAuth2(**self.creds)
             resp = auth.token()
             code = resp["status_code"]
@@ -175,6 +175,8 @@ class LocalTester:
         print("│  Step 2 / 4  取得租戶清單                │")
         print("└─────────────────────────────────────────┘")
 
+        from falconpy import FlightControl
+
         fc         = FlightControl(**self.creds)
         child_cids = set()
         offset     = 0
@@ -239,6 +241,8 @@ class LocalTester:
         print("│  Step 3 / 4  抓取各租戶端點數量          │")
         print("└─────────────────────────────────────────┘")
 
+        from falconpy import Hosts
+
         results = {}
         errors  = []
         total   = len(tenant_map)